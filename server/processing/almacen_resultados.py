@@ -0,0 +1,198 @@
+"""
+Almacén consolidado de resultados de revisión: un archivo JSON-lines por lote
+en lugar de un reviewed_<archivo>_page_N.json por página.
+
+- <lote>.jsonl: un resultado por línea, solo se agregan líneas al final.
+  Un lote completo se carga con una sola lectura secuencial (leer_lote).
+- <lote>.jsonl.idx: índice columnar {"pdfFile": [...], "page": [...],
+  "matricula": [...], "offset": [...], "length": [...]} para leer registros
+  sueltos sin recorrer el lote (buscar). Si falta o no corresponde al tamaño
+  del .jsonl (p. ej. tras una caída) se reconstruye recorriendo el lote.
+
+Los lectores ignoran una última línea sin "\n": es una escritura en curso o
+lo que dejó una caída. Varios procesos pueden agregar al mismo lote; cada
+línea se escribe con un candado del archivo (flock, donde existe), y solo
+con ese candado tomado se descarta una línea incompleta.
+"""
+import os
+import json
+import contextlib
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+EXTENSION_LOTE = ".jsonl"
+EXTENSION_INDICE = ".idx"
+VERSION_INDICE = 1
+
+_COLUMNAS = ("pdfFile", "page", "matricula", "offset", "length")
+
+
+def _indice_vacio():
+    indice = {"version": VERSION_INDICE, "bytes": 0}
+    indice.update({columna: [] for columna in _COLUMNAS})
+    return indice
+
+
+def _indexar(indice, registro, offset, length):
+    indice["pdfFile"].append(registro.get("pdfFile") or os.path.basename(registro.get("imagen_procesada", "")))
+    indice["page"].append(registro.get("page"))
+    indice["matricula"].append(registro.get("matricula"))
+    indice["offset"].append(offset)
+    indice["length"].append(length)
+    indice["bytes"] = offset + length
+
+
+@contextlib.contextmanager
+def _bloqueo(archivo):
+    """Candado exclusivo (advisory) del lote mientras se agrega o se repara una línea."""
+    if fcntl is None:
+        yield
+        return
+    fcntl.flock(archivo.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(archivo.fileno(), fcntl.LOCK_UN)
+
+
+def nombre_pagina(ruta, page_idx):
+    """Nombre de una página de PDF: el de su reviewed_<nombre>.json."""
+    return f"{os.path.splitext(os.path.basename(ruta))[0]}_page_{page_idx}"
+
+
+def nombre_imagen(ruta):
+    """Nombre de una imagen revisada: carpeta_archivo sin extensión."""
+    folder_name = os.path.basename(os.path.dirname(ruta))
+    file_name = os.path.basename(ruta).replace(".png", "").replace(".jpg", "").replace(".jpeg", "")
+    return f"{folder_name}_{file_name}"
+
+
+def archivo_resultado(registro):
+    """reviewed_*.json que corresponde a un resultado (misma regla que /grade-exams)."""
+    if registro.get("page"):
+        return f"reviewed_{nombre_pagina(registro['pdfFile'], registro['page'])}.json"
+    return f"reviewed_{nombre_imagen(registro.get('imagen_procesada', ''))}.json"
+
+
+def reconstruir_indice(ruta):
+    """Índice de un lote recorriéndolo completo (ignora una última línea incompleta)."""
+    indice = _indice_vacio()
+    offset = 0
+    with open(ruta, "rb") as f:
+        for linea in f:
+            if not linea.endswith(b"\n"):
+                break
+            _indexar(indice, json.loads(linea), offset, len(linea))
+            offset += len(linea)
+    return indice
+
+
+def cargar_indice(ruta):
+    """Índice del lote; se reconstruye si falta o quedó desfasado del .jsonl."""
+    try:
+        with open(ruta + EXTENSION_INDICE, encoding="utf-8") as f:
+            indice = json.load(f)
+        if indice.get("version") == VERSION_INDICE and indice.get("bytes") == os.path.getsize(ruta):
+            return indice
+    except (OSError, ValueError):
+        pass
+    return reconstruir_indice(ruta) if os.path.exists(ruta) else _indice_vacio()
+
+
+class AlmacenResultados:
+    """Escritor de un lote: agrega resultados al .jsonl y mantiene su índice."""
+
+    def __init__(self, ruta):
+        if not ruta.endswith(EXTENSION_LOTE):
+            ruta += EXTENSION_LOTE
+        self.ruta = ruta
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        # a+b: las escrituras van siempre al final aunque otro proceso también agregue
+        self._archivo = open(ruta, "a+b")
+        with _bloqueo(self._archivo):
+            self._indice = cargar_indice(ruta)
+            self._sincronizar()
+
+    def _sincronizar(self):
+        """
+        Con el candado tomado: indexa las líneas que otros procesos agregaron
+        desde la última escritura propia. Un índice guardado vigente termina
+        justo en el fin del archivo; solo tras reconstruirlo puede quedar una
+        última línea a medio escribir, que sin nadie escribiendo es de una
+        caída y se descarta.
+        """
+        offset = self._indice["bytes"]
+        if self._archivo.seek(0, os.SEEK_END) == offset:
+            return
+        self._archivo.seek(offset)
+        for linea in self._archivo:
+            if not linea.endswith(b"\n"):
+                self._archivo.truncate(offset)
+                break
+            _indexar(self._indice, json.loads(linea), offset, len(linea))
+            offset += len(linea)
+
+    def agregar(self, registro):
+        linea = (json.dumps(registro, ensure_ascii=False) + "\n").encode("utf-8")
+        with _bloqueo(self._archivo):
+            self._sincronizar()
+            offset = self._indice["bytes"]
+            self._archivo.write(linea)
+            self._archivo.flush()
+        _indexar(self._indice, registro, offset, len(linea))
+
+    def cerrar(self):
+        # El índice se escribe con el candado y al día, así cubre también lo de otros procesos
+        with _bloqueo(self._archivo):
+            self._sincronizar()
+            temporal = f"{self.ruta}{EXTENSION_INDICE}.{os.getpid()}.tmp"
+            with open(temporal, "w", encoding="utf-8") as f:
+                json.dump(self._indice, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(temporal, self.ruta + EXTENSION_INDICE)
+        self._archivo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+
+def leer_lote(ruta):
+    """Todos los resultados del lote, con una sola lectura secuencial (sin una última línea incompleta)."""
+    with open(ruta, "rb") as f:
+        datos = f.read()
+    return [json.loads(linea) for linea in datos.split(b"\n")[:-1] if linea.strip()]
+
+
+def iterar_lote(ruta, tamano_bloque=10000):
+    """Resultados del lote en listas de hasta tamano_bloque, leyendo secuencialmente (memoria acotada)."""
+    bloque = []
+    with open(ruta, "rb") as f:
+        for linea in f:
+            if not linea.endswith(b"\n"):
+                break  # Línea a medio escribir
+            if linea.strip():
+                bloque.append(json.loads(linea))
+            if len(bloque) == tamano_bloque:
+                yield bloque
+                bloque = []
+    if bloque:
+        yield bloque
+
+
+def buscar(ruta, pdfFile=None, page=None, matricula=None):
+    """Resultados del lote que coinciden con los filtros dados, leídos vía el índice."""
+    indice = cargar_indice(ruta)
+    encontrados = []
+    with open(ruta, "rb") as f:
+        for i, offset in enumerate(indice["offset"]):
+            if ((pdfFile is None or indice["pdfFile"][i] == pdfFile) and
+                    (page is None or indice["page"][i] == page) and
+                    (matricula is None or indice["matricula"][i] == matricula)):
+                f.seek(offset)
+                encontrados.append(json.loads(f.read(indice["length"][i])))
+    return encontrados
@@ -0,0 +1,197 @@
+"""
+Benchmark sintético del OMR: genera hojas con generate_answer_sheet.py,
+las llena con respuestas/matrícula/grupo aleatorios conocidos, las degrada
+(ruido, rotación, desenfoque, marcas tenues) y mide procesar_examen_completo.
+
+Reporta por número de preguntas: páginas/s, latencia p50/p95 por página,
+memoria pico y exactitud (hojas exactas y por campo). Cada configuración
+corre en un proceso hijo nuevo, así la memoria pico es solo la suya y no la
+acumulada de las anteriores; sus hojas aleatorias dependen solo de --seed y
+del número de preguntas. Todo corre offline en CPU.
+
+Uso:
+    python benchmark_omr.py [--questions 5 10 20] [--sheets 50] [--noise 8] [--rotation 2]
+                            [--blur 1.0] [--faint 0.1] [--layout] [--pyramid] [--cascade] [--output reporte.json]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import io
+import multiprocessing
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import generate_answer_sheet as gas
+import review_answer_sheet as ras
+
+TINTA = 30         # Nivel de gris de una marca normal
+TINTA_TENUE = 150  # Nivel de gris de una marca tenue
+RELLENO = 0.85     # Fracción del radio de la burbuja que cubre la marca
+
+
+def _memoria_pico_mb():
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KB; macOS, bytes
+    return round(pico / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def hoja_base(num_preguntas, directorio):
+    """PDF generado y rasterizado una vez por número de preguntas: (imagen BGR, layout)."""
+    ruta = os.path.join(directorio, f"hoja_{num_preguntas}.pdf")
+    with contextlib.redirect_stdout(io.StringIO()):
+        layout = gas.generar_hoja_respuestas(ruta, num_preguntas)
+    if max(layout["blocks"]["respuestas"]["pages"]) > 1:
+        raise ValueError(f"{num_preguntas} preguntas no caben en una página de la hoja generada")
+    paginas = ras.iterar_paginas_pdf(ruta, paginas=[1])
+    try:
+        _, imagen = next(paginas)
+        imagen = cv2.cvtColor(imagen, cv2.COLOR_RGB2BGR)
+    finally:
+        paginas.close()
+    return imagen, layout
+
+
+def llenar_hoja(base, layout, rng, faint=0.0):
+    """Dibuja marcas aleatorias. Devuelve (imagen, matrícula, grupo, respuestas) de verdad."""
+    imagen = base.copy()
+    escala = ras.PDF_DPI / 72
+
+    def marcar(burbuja):
+        x, y, r = burbuja
+        tinta = TINTA_TENUE if rng.random() < faint else TINTA
+        cv2.circle(imagen, (int(round(x * escala)), int(round(y * escala))),
+                   int(r * escala * RELLENO), (tinta, tinta, tinta), -1)
+
+    bloques = layout["blocks"]
+    verdad = {}
+    for tipo in ("matricula", "grupo", "respuestas"):
+        filas = bloques[tipo]["bubbles"]
+        elegidas = [int(rng.integers(len(fila))) for fila in filas]
+        for fila, col in zip(filas, elegidas):
+            marcar(fila[col])
+        verdad[tipo] = elegidas
+    respuestas = ["ABCDE"[c] for c in verdad["respuestas"]]
+    return imagen, verdad["matricula"], verdad["grupo"], respuestas
+
+
+def degradar(imagen, rng, noise=0.0, rotation=0.0, blur=0.0):
+    """Rotación aleatoria en ±rotation grados, desenfoque gaussiano y ruido gaussiano."""
+    if rotation:
+        h, w = imagen.shape[:2]
+        angulo = float(rng.uniform(-rotation, rotation))
+        matriz = cv2.getRotationMatrix2D((w / 2, h / 2), angulo, 1.0)
+        imagen = cv2.warpAffine(imagen, matriz, (w, h), flags=cv2.INTER_LINEAR, borderValue=(255, 255, 255))
+    if blur:
+        imagen = cv2.GaussianBlur(imagen, (0, 0), blur)
+    if noise:
+        ruido = rng.normal(0, noise, imagen.shape)
+        imagen = np.clip(imagen.astype(np.float32) + ruido, 0, 255).astype(np.uint8)
+    return imagen
+
+
+def correr_configuracion(num_preguntas, args, directorio):
+    rng = np.random.default_rng([args.seed, num_preguntas])
+    base, layout = hoja_base(num_preguntas, directorio)
+    ruta_png = os.path.join(directorio, "hoja.png")
+    latencias = []
+    exactas = {"hoja": 0, "respuestas": 0, "matricula": 0, "grupo": 0}
+    preguntas_ok = 0
+    filas_total = filas_completas = 0
+
+    for _ in range(args.sheets):
+        imagen, matricula, grupo, respuestas = llenar_hoja(base, layout, rng, args.faint)
+        cv2.imwrite(ruta_png, degradar(imagen, rng, args.noise, args.rotation, args.blur))
+
+        confianza = {}
+        inicio = time.perf_counter()
+        try:
+            mat, grp, detectadas = ras.procesar_examen_completo(
+                ruta_png, num_preguntas, layout=layout if args.layout else None, piramide=args.pyramid,
+                cascada=args.cascade, confianza=confianza)
+        except Exception:
+            mat, grp, detectadas = [], [], []
+        latencias.append(time.perf_counter() - inicio)
+        for filas in confianza.values():
+            filas_total += len(filas)
+            filas_completas += sum(1 for c in filas if not c or c.get("tier") != "fast")
+
+        obtenidas = [None] * num_preguntas
+        for d in detectadas:
+            if 1 <= d["question_number"] <= num_preguntas:
+                obtenidas[d["question_number"] - 1] = d["answer"]
+        ok = {"respuestas": obtenidas == respuestas, "matricula": mat == matricula, "grupo": grp == grupo}
+        for campo, valor in ok.items():
+            exactas[campo] += valor
+        exactas["hoja"] += all(ok.values())
+        preguntas_ok += sum(a == b for a, b in zip(obtenidas, respuestas))
+
+    latencias_ms = np.array(latencias) * 1000
+    return {
+        "questions": num_preguntas,
+        "sheets": args.sheets,
+        "pages_per_s": round(args.sheets / sum(latencias), 2),
+        "latency_ms": {"p50": round(float(np.percentile(latencias_ms, 50)), 2),
+                       "p95": round(float(np.percentile(latencias_ms, 95)), 2)},
+        "exact_match": {campo: round(valor / args.sheets, 4) for campo, valor in exactas.items()},
+        "question_accuracy": round(preguntas_ok / (args.sheets * num_preguntas), 4),
+        # Con --cascade: fracción de filas que pasaron por la vía completa
+        "full_path_rows": round(filas_completas / filas_total, 4) if args.cascade and filas_total else None,
+        # Pico del proceso hijo de esta configuración (importaciones incluidas)
+        "peak_rss_mb": _memoria_pico_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sintético de throughput y exactitud del OMR")
+    parser.add_argument("--questions", type=int, nargs="+", default=[5, 10, 20],
+                        help="Números de preguntas a probar (una hoja de una página: máx. 21)")
+    parser.add_argument("--sheets", type=int, default=50, help="Hojas por configuración (default: 50)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--noise", type=float, default=0.0, help="Desv. estándar del ruido gaussiano (niveles de gris)")
+    parser.add_argument("--rotation", type=float, default=0.0, help="Rotación aleatoria máxima en grados")
+    parser.add_argument("--blur", type=float, default=0.0, help="Sigma del desenfoque gaussiano en píxeles")
+    parser.add_argument("--faint", type=float, default=0.0, help="Fracción de marcas tenues (0-1)")
+    parser.add_argument("--layout", action="store_true", help="Revisar con el layout de la hoja (ver --layout del revisor)")
+    parser.add_argument("--pyramid", action="store_true", help="Detección de bloques en pirámide")
+    parser.add_argument("--cascade", action="store_true", help="Decodificación en cascada (vía rápida + filas dudosas)")
+    parser.add_argument("--output", default=None, help="Archivo del reporte (default: stdout)")
+    args = parser.parse_args()
+
+    # spawn y no fork: un hijo bifurcado hereda como pico el RSS actual del padre
+    contexto = multiprocessing.get_context("spawn")
+    configuraciones = []
+    with tempfile.TemporaryDirectory() as directorio:
+        for num_preguntas in args.questions:
+            try:
+                with contexto.Pool(1) as pool:
+                    configuraciones.append(pool.apply(correr_configuracion, (num_preguntas, args, directorio)))
+            except ValueError as e:
+                configuraciones.append({"questions": num_preguntas, "error": str(e)})
+
+    reporte = {
+        "params": {k: v for k, v in vars(args).items() if k != "output"},
+        "dpi": ras.PDF_DPI,
+        "results": configuraciones,
+    }
+    texto = json.dumps(reporte, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Compara la detección de bloques en pirámide (--pyramid) contra la búsqueda
+en la página completa: latencia por página y coincidencia de bloques y
+resultados.
+
+Uso:
+    python benchmark_piramide.py <pdf|imagen|directorio|glob> [...] [--repeticiones N]
+
+Imprime un JSON con una entrada por página y un resumen agregado.
+"""
+import sys
+import os
+import json
+import time
+import argparse
+
+import cv2
+import numpy as np
+
+import review_answer_sheet as ras
+
+
+def _medir(funcion, repeticiones):
+    """Mejor tiempo (ms) de varias ejecuciones y el resultado de la última."""
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        mejor = min(mejor, time.perf_counter() - inicio)
+    return mejor * 1000, resultado
+
+
+def _paginas(rutas):
+    """Genera (nombre, página, gray) para cada página de cada documento."""
+    for ruta in rutas:
+        if os.path.splitext(ruta)[1].lower() == ".pdf":
+            for page_idx, imagen in ras.iterar_paginas_pdf(ruta):
+                if imagen is not None:
+                    yield os.path.basename(ruta), page_idx, ras._a_escala_de_grises(imagen, "RGB")
+        else:
+            imagen = cv2.imread(ruta)
+            if imagen is not None:
+                yield os.path.basename(ruta), 1, ras._a_escala_de_grises(imagen)
+
+
+def _diferencia_bloques(a, b):
+    """Máxima diferencia en píxeles entre los bbox de ambos métodos (None si alguno falló)."""
+    if a is None or b is None:
+        return None
+    return max(int(np.abs(np.subtract(a[t]["bbox"], b[t]["bbox"])).max()) for t in a)
+
+
+def comparar_pagina(gray, repeticiones=5):
+    ms_completa, bloques_completa = _medir(lambda: ras.detectar_bloques(gray), repeticiones)
+    ms_piramide, bloques_piramide = _medir(lambda: ras.detectar_bloques_piramide(gray), repeticiones)
+    ms_total_completa, res_completa = _medir(lambda: ras.procesar_examen_desde_array(gray), repeticiones)
+    ms_total_piramide, res_piramide = _medir(lambda: ras.procesar_examen_desde_array(gray, piramide=True), repeticiones)
+    return {
+        "bloques_ms": {"completa": round(ms_completa, 2), "piramide": round(ms_piramide, 2)},
+        "pagina_ms": {"completa": round(ms_total_completa, 2), "piramide": round(ms_total_piramide, 2)},
+        "bbox_max_diff_px": _diferencia_bloques(bloques_completa, bloques_piramide),
+        "mismo_resultado": res_completa == res_piramide
+    }
+
+
+def _percentiles(valores):
+    return {"p50": round(float(np.percentile(valores, 50)), 2), "p95": round(float(np.percentile(valores, 95)), 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de la detección de bloques en pirámide")
+    parser.add_argument("entradas", nargs="+", help="PDFs, imágenes, directorios, globs o manifiestos .txt")
+    parser.add_argument("--repeticiones", type=int, default=5,
+                        help="Ejecuciones por página; se reporta el mejor tiempo (default: 5)")
+    args = parser.parse_args()
+
+    paginas = []
+    for nombre, page_idx, gray in _paginas(ras.expandir_entradas(args.entradas)):
+        registro = {"archivo": nombre, "page": page_idx}
+        registro.update(comparar_pagina(gray, args.repeticiones))
+        paginas.append(registro)
+
+    if not paginas:
+        print(json.dumps({"error": "No se encontraron páginas para comparar."}))
+        sys.exit(1)
+
+    resumen = {"paginas": len(paginas)}
+    for etapa in ("bloques_ms", "pagina_ms"):
+        completa = [p[etapa]["completa"] for p in paginas]
+        piramide = [p[etapa]["piramide"] for p in paginas]
+        resumen[etapa] = {
+            "completa": _percentiles(completa),
+            "piramide": _percentiles(piramide),
+            "aceleracion": round(sum(completa) / sum(piramide), 2)
+        }
+    resumen["bloques_iguales"] = sum(p["bbox_max_diff_px"] == 0 for p in paginas)
+    resumen["resultados_iguales"] = sum(p["mismo_resultado"] for p in paginas)
+
+    print(json.dumps({"paginas": paginas, "resumen": resumen}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Caché en disco de resultados de revisión (review_answer_sheet.py).
+
+Cada página revisada se guarda bajo una clave que combina el hash del
+contenido del documento, el número de página y la configuración de la
+revisión, de modo que volver a revisar un archivo sin cambios no vuelve a
+rasterizar ni a correr la visión. El hash de cada archivo se recuerda junto
+con su tamaño y fecha de modificación para no releerlo si no cambió. Los valores son JSON comprimido en una
+base SQLite; cuando el total supera el límite se descartan primero las
+entradas usadas hace más tiempo (LRU).
+
+Si la base falla a media corrida (p. ej. "database is locked" con varios
+procesos compitiendo o el disco lleno), el error se avisa por stderr y la
+caché queda desactivada en ese proceso: la revisión sigue sin caché.
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import functools
+
+CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
+CACHE_PATH = os.environ.get("REVIEW_CACHE_PATH", os.path.join(CACHE_DIR, "revisiones.sqlite"))
+CACHE_MAX_BYTES = int(float(os.environ.get("REVIEW_CACHE_MAX_MB", "256")) * 1024 * 1024)
+
+_BLOQUE_LECTURA = 1 << 20
+
+
+def hash_archivo(ruta):
+    """SHA-256 del contenido del archivo, leído por bloques."""
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(_BLOQUE_LECTURA), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def clave_pagina(hash_documento, page_idx, configuracion):
+    """Clave de una página: contenido + índice + configuración (dict serializable a JSON)."""
+    texto = json.dumps([hash_documento, page_idx, configuracion], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+
+def _sin_fallar(por_defecto):
+    """
+    Decorador: un sqlite3.Error desactiva la caché (aviso por stderr) y el
+    método devuelve por_defecto(self, *args); desactivada, no toca la base.
+    """
+    def decorar(metodo):
+        @functools.wraps(metodo)
+        def envoltura(self, *args):
+            if not self.desactivada:
+                try:
+                    return metodo(self, *args)
+                except sqlite3.Error as e:
+                    self.desactivada = True
+                    sys.stderr.write(f"[WARN] Caché de resultados desactivada: {e}\n")
+            return por_defecto(self, *args)
+        return envoltura
+    return decorar
+
+
+class CacheResultados:
+    """Caché LRU acotada por tamaño sobre SQLite; segura entre procesos."""
+
+    def __init__(self, ruta=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self._total = None  # Tamaño estimado; se recalcula antes de desalojar
+        self.desactivada = False
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        self._con = sqlite3.connect(ruta, timeout=30)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute("PRAGMA synchronous=NORMAL")
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS resultados ("
+            " clave TEXT PRIMARY KEY, valor BLOB NOT NULL, tamano INTEGER NOT NULL, usado REAL NOT NULL)")
+        self._con.execute("CREATE INDEX IF NOT EXISTS idx_resultados_usado ON resultados(usado)")
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS archivos ("
+            " ruta TEXT PRIMARY KEY, tamano INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL)")
+        self._con.commit()
+
+    @_sin_fallar(lambda self, ruta: hash_archivo(ruta))
+    def hash_documento(self, ruta):
+        """hash_archivo(ruta), sin releer el archivo si su tamaño y mtime no cambiaron."""
+        ruta = os.path.abspath(ruta)
+        st = os.stat(ruta)
+        fila = self._con.execute("SELECT tamano, mtime_ns, hash FROM archivos WHERE ruta = ?", (ruta,)).fetchone()
+        if fila is not None and fila[0] == st.st_size and fila[1] == st.st_mtime_ns:
+            return fila[2]
+        digest = hash_archivo(ruta)
+        self._con.execute("INSERT OR REPLACE INTO archivos (ruta, tamano, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+                          (ruta, st.st_size, st.st_mtime_ns, digest))
+        self._con.commit()
+        return digest
+
+    @_sin_fallar(lambda self, claves: {})
+    def obtener_varios(self, claves):
+        """Devuelve {clave: resultado} para las claves presentes y marca su uso."""
+        claves = list(claves)
+        encontrados = {}
+        for i in range(0, len(claves), 500):
+            lote = claves[i:i + 500]
+            filas = self._con.execute(
+                f"SELECT clave, valor FROM resultados WHERE clave IN ({','.join('?' * len(lote))})", lote)
+            for clave, valor in filas:
+                encontrados[clave] = json.loads(zlib.decompress(valor))
+        if encontrados:
+            ahora = time.time()
+            self._con.executemany("UPDATE resultados SET usado = ? WHERE clave = ?",
+                                  [(ahora, clave) for clave in encontrados])
+            self._con.commit()
+        return encontrados
+
+    def obtener(self, clave):
+        return self.obtener_varios([clave]).get(clave)
+
+    @_sin_fallar(lambda self, clave, resultado: None)
+    def guardar(self, clave, resultado):
+        valor = zlib.compress(json.dumps(resultado, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        self._con.execute("INSERT OR REPLACE INTO resultados (clave, valor, tamano, usado) VALUES (?, ?, ?, ?)",
+                          (clave, valor, len(valor), time.time()))
+        self._con.commit()
+        if self._total is None:
+            self._total = self._tamano_total()
+        else:
+            self._total += len(valor)
+        if self._total > self.max_bytes:
+            self._desalojar()
+
+    def _tamano_total(self):
+        return self._con.execute("SELECT COALESCE(SUM(tamano), 0) FROM resultados").fetchone()[0]
+
+    def _desalojar(self):
+        """Elimina las entradas menos usadas hasta quedar en el 90% del límite."""
+        total = self._tamano_total()
+        self._total = total
+        if total <= self.max_bytes:
+            return
+        sobrante = total - int(self.max_bytes * 0.9)
+        claves = []
+        for clave, tamano in self._con.execute("SELECT clave, tamano FROM resultados ORDER BY usado"):
+            claves.append((clave,))
+            sobrante -= tamano
+            if sobrante <= 0:
+                break
+        self._con.executemany("DELETE FROM resultados WHERE clave = ?", claves)
+        self._con.commit()
+        self._total = self._tamano_total()
+
+    def cerrar(self):
+        self._con.close()
@@ -1,12 +1,56 @@
 import sys
-from reportlab.pdfgen import canvas
+import io
+import json
+import shutil
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
 import os
 
-def generar_hoja_respuestas(nombre_archivo, num_preguntas=20):
-    c = canvas.Canvas(nombre_archivo, pagesize=letter)
+# Versión del formato del layout JSON; cambiarla si cambia la geometría de la hoja
+# v2: marcas de registro (fiduciales) en las cuatro esquinas
+LAYOUT_VERSION = 2
+
+# Plantillas ya dibujadas por número de preguntas: la hoja no depende del
+# examen (id y título solo cambian el nombre del archivo), así que una hoja
+# nueva es una copia de la plantilla y reportlab solo se usa al crearla
+PLANTILLAS_DIR = os.environ.get("ANSWER_SHEET_TEMPLATES_DIR",
+                                os.path.join(os.path.dirname(__file__), "cache", "plantillas"))
+
+# Marcas de registro: cuadros rellenos centrados a esta distancia de cada esquina
+FIDUCIAL_LADO = 18
+FIDUCIAL_MARGEN = 0.45 * inch
+
+def _rect_layout(height, x, y, w, h):
+    """Convierte un rect de reportlab (origen abajo-izquierda) a [x, y, w, h] con origen arriba-izquierda."""
+    return [round(x, 3), round(height - (y + h), 3), round(w, 3), round(h, 3)]
+
+def _circulo_layout(height, x, y, r):
+    return [round(x, 3), round(height - y, 3), r]
+
+def _dibujar_fiduciales(c, width, height):
+    """Dibuja las 4 marcas de registro y devuelve sus centros (origen arriba-izquierda)."""
+    centros = []
+    for cx, cy in ((FIDUCIAL_MARGEN, height - FIDUCIAL_MARGEN), (width - FIDUCIAL_MARGEN, height - FIDUCIAL_MARGEN),
+                   (width - FIDUCIAL_MARGEN, FIDUCIAL_MARGEN), (FIDUCIAL_MARGEN, FIDUCIAL_MARGEN)):
+        c.rect(cx - FIDUCIAL_LADO / 2, cy - FIDUCIAL_LADO / 2, FIDUCIAL_LADO, FIDUCIAL_LADO, stroke=0, fill=1)
+        centros.append([round(cx, 3), round(height - cy, 3)])
+    return centros
+
+def _dibujar_hoja(c, num_preguntas):
+    """
+    Dibuja la hoja en el canvas y devuelve su layout: rectángulos de bloque y
+    centros/radios de cada burbuja en puntos PDF con origen arriba-izquierda.
+    """
     width, height = letter
+    layout = {
+        "version": LAYOUT_VERSION,
+        "num_preguntas": num_preguntas,
+        "page_size": [width, height],
+        "blocks": {}
+    }
+
+    # Marcas de registro: sup-izq, sup-der, inf-der, inf-izq
+    layout["fiducials"] = {"size": FIDUCIAL_LADO, "centers": _dibujar_fiduciales(c, width, height)}
 
     # Encabezado (se mantiene en la posición alta)
     c.setFont("Helvetica-Bold", 14)
@@ -34,11 +78,15 @@ def generar_hoja_respuestas(nombre_archivo, num_preguntas=20):
         x = start_x_matricula + col * spacing_x_mat
         y_num = start_y_matricula + 10
         c.drawCentredString(x, y_num, str(col))
+    burbujas_mat = []
     for row in range(mat_rows):
+        fila = []
         for col in range(mat_cols):
             x = start_x_matricula + col * spacing_x_mat
             y = start_y_matricula - row * spacing_y_mat
             c.circle(x, y, circle_size, stroke=1, fill=0)
+            fila.append(_circulo_layout(height, x, y, circle_size))
+        burbujas_mat.append(fila)
 
     padding = 7
     rect_x = start_x_matricula - circle_size - padding
@@ -46,6 +94,10 @@ def generar_hoja_respuestas(nombre_archivo, num_preguntas=20):
     rect_width = (mat_cols - 1) * spacing_x_mat + 2 * circle_size + 2 * padding
     rect_height = (mat_rows - 1) * spacing_y_mat + 2 * circle_size + 2 * padding
     c.rect(rect_x, rect_y, rect_width, rect_height)
+    layout["blocks"]["matricula"] = {
+        "rect": _rect_layout(height, rect_x, rect_y, rect_width, rect_height),
+        "filas": mat_rows, "columnas": mat_cols, "bubbles": burbujas_mat
+    }
 
     c.setFont("Helvetica", 12)
 
@@ -63,17 +115,25 @@ def generar_hoja_respuestas(nombre_archivo, num_preguntas=20):
         x = start_x_grupo + col * spacing_x_grupo
         y_num = start_y_grupo + 10
         c.drawCentredString(x, y_num, str(col))
+    burbujas_grupo = []
     for row in range(grupo_rows):
+        fila = []
         for col in range(grupo_cols):
             x = start_x_grupo + col * spacing_x_grupo
             y = start_y_grupo - row * spacing_y_grupo
             c.circle(x, y, circle_size, stroke=1, fill=0)
+            fila.append(_circulo_layout(height, x, y, circle_size))
+        burbujas_grupo.append(fila)
 
     rect_x_g = start_x_grupo - circle_size - padding
     rect_y_g = start_y_grupo - (grupo_rows - 1) * spacing_y_grupo - circle_size - padding
     rect_width_g = (grupo_cols - 1) * spacing_x_grupo + 2 * circle_size + 2 * padding
     rect_height_g = (grupo_rows - 1) * spacing_y_grupo + 2 * circle_size + 2 * padding
     c.rect(rect_x_g, rect_y_g, rect_width_g, rect_height_g)
+    layout["blocks"]["grupo"] = {
+        "rect": _rect_layout(height, rect_x_g, rect_y_g, rect_width_g, rect_height_g),
+        "filas": grupo_rows, "columnas": grupo_cols, "bubbles": burbujas_grupo
+    }
 
     c.setFont("Helvetica", 12)
 
@@ -99,38 +159,119 @@ def generar_hoja_respuestas(nombre_archivo, num_preguntas=20):
         x = 1.0 * inch + j * 1 * inch
         c.drawCentredString(x, y_letras, op)
 
+    burbujas_resp = []
+    pagina = 1
+    paginas_resp = []
     for i in range(1, num_preguntas + 1):
         y = start_y - (i - 1) * pregunta_altura
         c.setFont("Helvetica", 10)
         c.drawString(0.6 * inch, y, f"{i}.")
 
+        fila = []
         for j, op in enumerate(opciones):
             x = 1.0 * inch + j * 1 * inch
             c.circle(x, y + 3, radio, stroke=1, fill=0)
+            fila.append(_circulo_layout(height, x, y + 3, radio))
+        burbujas_resp.append(fila)
+        paginas_resp.append(pagina)
 
         if y < 1 * inch:
             c.showPage()
+            _dibujar_fiduciales(c, width, height)
             start_y = height - 1.5 * inch
+            pagina += 1
+
+    layout["blocks"]["respuestas"] = {
+        "rect": _rect_layout(height, left_x_q, bottom_y_q, right_x_q - left_x_q, top_y_q - bottom_y_q),
+        "filas": num_preguntas, "columnas": len(opciones), "bubbles": burbujas_resp,
+        "pages": paginas_resp
+    }
+    return layout
+
+def _canvas(destino):
+    # Importar el canvas de reportlab toma ~0.1 s; con la plantilla en caché no hace falta
+    from reportlab.pdfgen import canvas
+    return canvas.Canvas(destino, pagesize=letter)
+
+def calcular_layout(num_preguntas=20):
+    """Layout de la hoja sin escribir el PDF (se dibuja sobre un buffer descartable)."""
+    return _dibujar_hoja(_canvas(io.BytesIO()), num_preguntas)
 
+def guardar_layout(layout, ruta):
+    with open(ruta, "w", encoding="utf-8") as f:
+        json.dump(layout, f, ensure_ascii=False)
+
+def _dibujar_pdf(nombre_archivo, num_preguntas):
+    c = _canvas(nombre_archivo)
+    layout = _dibujar_hoja(c, num_preguntas)
     c.save()
+    return layout
+
+def plantilla_hoja(num_preguntas):
+    """
+    (ruta del PDF, layout) de la plantilla para num_preguntas, clave junto con
+    LAYOUT_VERSION. Se dibuja solo si no está en caché; el PDF y el layout se
+    escriben a un temporal y se renombran, así que varios procesos creando
+    exámenes a la vez nunca leen una plantilla a medias.
+    """
+    base = os.path.join(PLANTILLAS_DIR, f"hoja_v{LAYOUT_VERSION}_{num_preguntas}")
+    ruta_pdf, ruta_layout = base + ".pdf", base + ".json"
+    try:
+        # El layout se escribe al final: si existe, la plantilla está completa
+        with open(ruta_layout, encoding="utf-8") as f:
+            layout = json.load(f)
+        if os.path.exists(ruta_pdf):
+            return ruta_pdf, layout
+    except (OSError, ValueError):
+        pass
+
+    os.makedirs(PLANTILLAS_DIR, exist_ok=True)
+    temporal = f"{base}.{os.getpid()}.tmp"
+    layout = _dibujar_pdf(temporal, num_preguntas)
+    os.replace(temporal, ruta_pdf)
+    guardar_layout(layout, temporal)
+    os.replace(temporal, ruta_layout)
+    return ruta_pdf, layout
+
+def generar_hoja_respuestas(nombre_archivo, num_preguntas=20, usar_plantilla=True):
+    """
+    Escribe la hoja en nombre_archivo y devuelve su layout. Con usar_plantilla
+    la hoja se copia de la plantilla en caché (ver plantilla_hoja); si la
+    caché no se puede usar se dibuja directamente.
+    """
+    layout = None
+    if usar_plantilla:
+        try:
+            ruta_plantilla, layout = plantilla_hoja(num_preguntas)
+            shutil.copyfile(ruta_plantilla, nombre_archivo)
+        except OSError as e:
+            sys.stderr.write(f"[WARN] Plantilla de hoja no disponible: {e}\n")
+            layout = None
+    if layout is None:
+        layout = _dibujar_pdf(nombre_archivo, num_preguntas)
     print(f"PDF generado: {nombre_archivo}")
+    return layout
 
 # El código para ejecutar desde la terminal se mantiene igual
 if __name__ == "__main__":
     if len(sys.argv) < 3:
         print("Uso: python tu_script.py <exam_id> <num_preguntas> <safe_title>")
         sys.exit(1)
-    
+
     exam_id = sys.argv[1]
     num_preguntas = int(sys.argv[2])
     safe_title = sys.argv[3] if len(sys.argv) > 3 else "exam"
-    
+
     # Crear carpeta de PDFs generados si no existe
     generated_pdfs_dir = os.path.join(os.path.dirname(__file__), "generated_pdfs")
     os.makedirs(generated_pdfs_dir, exist_ok=True)
-    
+
     # Crear nombre de archivo con exam_id y title
     nombre_archivo = os.path.join(generated_pdfs_dir, f"answer_sheet_{exam_id}_{safe_title}.pdf")
-    
+
     # Generar la hoja de respuestas
-    generar_hoja_respuestas(nombre_archivo, num_preguntas)
\ No newline at end of file
+    layout = generar_hoja_respuestas(nombre_archivo, num_preguntas)
+
+    # Layout versionado junto al PDF, para que el revisor muestree las burbujas sin Hough
+    layout["exam_id"] = exam_id
+    guardar_layout(layout, os.path.join(generated_pdfs_dir, f"layout_{exam_id}.json"))
@@ -0,0 +1,112 @@
+"""
+Geometría compartida por la revisión de burbujas (review_answer_sheet.py) y
+la detección de cuadros (text_detection.py): fusión de círculos repetidos
+con una rejilla hash, agrupación en filas ordenando y cortando en los saltos
+(burbujas) y agrupación en líneas por la media de cada línea (cuadros). Las
+dos primeras son casi lineales en el número de elementos, así que cientos de
+círculos de Hough por bloque en un escaneo ruidoso no pesan; la última es
+lineal por el número de líneas, que en el encabezado son pocas.
+
+Los ejemplos son la prueba de regresión: python -m doctest geometria.py
+"""
+import numpy as np
+
+
+def fusionar_circulos(circulos, distancia):
+    """
+    Fusiona los círculos ((x, y), r) cuyos centros están a menos de
+    distancia. Recorre los círculos de izquierda a derecha; cada círculo aún
+    libre absorbe a los libres que tiene cerca y el grupo se reemplaza por su
+    promedio (enteros truncados). Los vecinos se buscan solo en las 3x3
+    celdas de una rejilla de lado distancia alrededor del círculo.
+    """
+    if not circulos:
+        return []
+    # Enteros de Python: los centros de Hough llegan como uint16 y restarlos desborda
+    xs = np.array([int(c[0][0]) for c in circulos], dtype=np.float64)
+    ys = np.array([int(c[0][1]) for c in circulos], dtype=np.float64)
+    rs = np.array([int(c[1]) for c in circulos], dtype=np.float64)
+    orden = np.argsort(xs, kind="stable")
+    xs, ys, rs = xs[orden], ys[orden], rs[orden]
+
+    lado = max(float(distancia), 1e-9)
+    celdas_x = np.floor(xs / lado).astype(np.int64)
+    celdas_y = np.floor(ys / lado).astype(np.int64)
+    rejilla = {}
+    for i, celda in enumerate(zip(celdas_x.tolist(), celdas_y.tolist())):
+        rejilla.setdefault(celda, []).append(i)
+
+    limite = distancia * distancia
+    usado = np.zeros(len(xs), dtype=bool)
+    fusionados = []
+    for i in range(len(xs)):
+        if usado[i]:
+            continue
+        cx, cy = celdas_x[i], celdas_y[i]
+        vecinos = [j for dx in (-1, 0, 1) for dy in (-1, 0, 1) for j in rejilla.get((cx + dx, cy + dy), ())
+                   if not usado[j]]
+        vecinos = np.array(vecinos, dtype=np.int64)
+        cerca = vecinos[((xs[vecinos] - xs[i]) ** 2 + (ys[vecinos] - ys[i]) ** 2 < limite) | (vecinos == i)]
+        usado[cerca] = True
+        fusionados.append(((int(xs[cerca].mean()), int(ys[cerca].mean())), int(rs[cerca].mean())))
+    return fusionados
+
+
+def separar_en_grupos(valores, umbral):
+    """
+    Ordena valores (orden estable) y corta donde dos consecutivos distan
+    umbral o más. Devuelve una lista de arreglos de índices, del grupo de
+    menor valor al de mayor.
+    """
+    valores = np.asarray(valores, dtype=np.float64)
+    if valores.size == 0:
+        return []
+    orden = np.argsort(valores, kind="stable")
+    cortes = np.flatnonzero(np.abs(np.diff(valores[orden])) >= umbral) + 1
+    return np.split(orden, cortes)
+
+
+def agrupar_en_filas(puntos, umbral):
+    """
+    Agrupa puntos (x, y) en filas: separar_en_grupos sobre y y, dentro de
+    cada fila, orden por x. Devuelve listas de índices de los puntos.
+    """
+    if not len(puntos):
+        return []
+    puntos = np.asarray(puntos, dtype=np.float64)
+    filas = []
+    for indices in separar_en_grupos(puntos[:, 1], umbral):
+        filas.append(indices[np.argsort(puntos[indices, 0], kind="stable")].tolist())
+    return filas
+
+
+def agrupar_por_media(puntos, tolerancia):
+    """
+    Agrupa puntos (x, y) en líneas en el orden de entrada: cada punto va a la
+    primera línea cuya y media (la de sus puntos hasta ese momento) esté a
+    menos de tolerancia; si no hay ninguna, abre una línea nueva. Las líneas
+    se ordenan por su y media y, dentro de cada una, por x (empates en el
+    orden de entrada). Devuelve listas de índices de los puntos.
+
+    A diferencia de agrupar_en_filas, una cadena de saltos menores que la
+    tolerancia no une líneas que se van corriendo (hoja un poco girada):
+
+    >>> agrupar_por_media([(0, 0), (0, 20), (0, 40), (0, 60)], 30)
+    [[0, 1], [2, 3]]
+    >>> agrupar_en_filas([(0, 0), (0, 20), (0, 40), (0, 60)], 30)
+    [[0, 1, 2, 3]]
+    >>> agrupar_por_media([(50, 12), (10, 0), (10, 100), (30, 5)], 30)
+    [[1, 3, 0], [2]]
+    """
+    lineas, sumas = [], []
+    for i, (_, y) in enumerate(puntos):
+        for k, linea in enumerate(lineas):
+            if abs(y - sumas[k] / len(linea)) < tolerancia:
+                linea.append(i)
+                sumas[k] += y
+                break
+        else:
+            lineas.append([i])
+            sumas.append(y)
+    orden = sorted(range(len(lineas)), key=lambda k: sumas[k] / len(lineas[k]))
+    return [sorted(lineas[k], key=lambda i: (puntos[i][0], i)) for k in orden]
@@ -0,0 +1,238 @@
+"""
+Calificación vectorizada de un lote de hojas revisadas.
+
+Las respuestas de todo el lote se convierten en una matriz uint8
+alumnos x preguntas (0 = sin respuesta, 1..5 = A..E) y se comparan contra la
+clave de una sola vez, igual que la ruta /grade-exams pero sin recorrer
+pregunta por pregunta.
+
+Uso:
+    python grade_answers.py --key clave.json <lote.jsonl|reviewed_*.json|carpeta> [...] [--details]
+
+clave.json: lista (o {"questions": [...]}) de
+    {"question_number": 1, "answer": "A", "score_value": 1}
+("option_text" se acepta en lugar de "answer"; score_value por defecto 1).
+"""
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from almacen_resultados import EXTENSION_LOTE, archivo_resultado, iterar_lote
+
+LETRAS = "ABCDE"
+SIN_RESPUESTA = 0
+# Letra (may/min) -> código de la matriz
+_CODIGOS = {letra: i + 1 for i, letra in enumerate(LETRAS)}
+_CODIGOS.update({letra.lower(): codigo for letra, codigo in list(_CODIGOS.items())})
+
+
+def cargar_clave(ruta):
+    """
+    Lee la clave de respuestas. Devuelve (clave uint8 [Q], puntajes float32 [Q]);
+    las preguntas sin respuesta correcta quedan con código 0 y nunca cuentan.
+    """
+    with open(ruta, encoding="utf-8") as f:
+        datos = json.load(f)
+    preguntas = datos["questions"] if isinstance(datos, dict) else datos
+    num_preguntas = max(int(p["question_number"]) for p in preguntas)
+    clave = np.zeros(num_preguntas, dtype=np.uint8)
+    puntajes = np.ones(num_preguntas, dtype=np.float32)
+    for p in preguntas:
+        i = int(p["question_number"]) - 1
+        letra = str(p.get("answer", p.get("option_text", ""))).strip()
+        clave[i] = _CODIGOS.get(letra, SIN_RESPUESTA)
+        if p.get("score_value"):
+            puntajes[i] = float(p["score_value"])
+    return clave, puntajes
+
+
+def matriz_respuestas(resultados, num_preguntas):
+    """
+    Matriz uint8 alumnos x preguntas a partir de los "preguntas_detectadas" de
+    cada resultado. Preguntas fuera de rango o letras desconocidas se ignoran.
+    Devuelve también cuántas respuestas detectó cada hoja (total_questions).
+    """
+    filas, columnas, codigos = [], [], []
+    detectadas = np.zeros(len(resultados), dtype=np.int32)
+    for fila, resultado in enumerate(resultados):
+        respuestas = resultado.get("preguntas_detectadas") or []
+        detectadas[fila] = len(respuestas)
+        for r in respuestas:
+            filas.append(fila)
+            columnas.append(int(r["question_number"]) - 1)
+            codigos.append(_CODIGOS.get(str(r["answer"]).strip(), SIN_RESPUESTA))
+
+    matriz = np.zeros((len(resultados), num_preguntas), dtype=np.uint8)
+    if filas:
+        filas = np.asarray(filas, dtype=np.int64)
+        columnas = np.asarray(columnas, dtype=np.int64)
+        validas = (columnas >= 0) & (columnas < num_preguntas)
+        matriz[filas[validas], columnas[validas]] = np.asarray(codigos, dtype=np.uint8)[validas]
+    return matriz, detectadas
+
+
+def calificar(matriz, clave, puntajes):
+    """
+    Compara la matriz contra la clave. Devuelve un dict de arreglos:
+    correctas (bool alumnos x preguntas), aciertos y puntaje por alumno, y
+    proporción de aciertos por pregunta.
+    """
+    correctas = (matriz == clave) & (clave != SIN_RESPUESTA)
+    return {
+        "correctas": correctas,
+        "aciertos": correctas.sum(axis=1, dtype=np.int32),
+        "puntaje": correctas @ puntajes,
+        "por_pregunta": correctas.mean(axis=0) if len(matriz) else np.zeros(len(clave)),
+    }
+
+
+def _leer_resultado_json(ruta):
+    """
+    Resultado de revisión leído de un .json, o None (con aviso por stderr) si
+    el archivo no es uno: JSON inválido, una lista, un layout u otro objeto
+    sin "preguntas_detectadas". Los resultados con "error" sí se devuelven y
+    se descartan después, igual que los del almacén.
+    """
+    try:
+        with open(ruta, encoding="utf-8") as f:
+            datos = json.load(f)
+    except ValueError as e:
+        sys.stderr.write(f"[WARN] Se omite {ruta}: JSON inválido ({e})\n")
+        return None
+    if not isinstance(datos, dict) or ("preguntas_detectadas" not in datos and "error" not in datos):
+        sys.stderr.write(f"[WARN] Se omite {ruta}: no es un resultado de revisión\n")
+        return None
+    return datos
+
+
+def _registros_lote(ruta, tamano_bloque):
+    """Resultados de página de un almacén (sin errores ni resúmenes), en orden."""
+    for bloque in iterar_lote(ruta, tamano_bloque):
+        for registro in bloque:
+            if "error" not in registro and not registro.get("summary"):
+                yield registro
+
+
+def iterar_resultados_en_bloques(entradas, tamano_bloque=10000):
+    """
+    Genera (resultados, nombres) en bloques de hasta tamano_bloque resultados
+    de página, leídos de almacenes .jsonl, archivos reviewed_*.json o carpetas
+    con ellos. La memoria queda acotada por el tamaño del bloque.
+
+    Cada página se nombra como su reviewed_*.json y se califica una sola vez,
+    igual que en /grade-exams: si está en un almacén gana su última versión
+    ahí (p. ej. tras revisarla de nuevo), y si no, su reviewed_*.json.
+    """
+    rutas = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            rutas.extend(os.path.join(entrada, f) for f in sorted(os.listdir(entrada))
+                         if f.endswith(".json") or f.endswith(EXTENSION_LOTE))
+        else:
+            rutas.append(entrada)
+
+    # Primera pasada por los almacenes: dónde está la última versión de cada página
+    ultima = {}
+    for i, ruta in enumerate(rutas):
+        if ruta.endswith(EXTENSION_LOTE):
+            for j, registro in enumerate(_registros_lote(ruta, tamano_bloque)):
+                ultima[archivo_resultado(registro)] = (i, j)
+
+    resultados, nombres = [], []
+    vistos = set()
+    for i, ruta in enumerate(rutas):
+        if ruta.endswith(EXTENSION_LOTE):
+            registros = ((archivo_resultado(r), r) for j, r in enumerate(_registros_lote(ruta, tamano_bloque))
+                         if ultima[archivo_resultado(r)] == (i, j))
+        else:
+            nombre = os.path.basename(ruta)
+            registro = None if nombre in ultima or nombre in vistos else _leer_resultado_json(ruta)
+            vistos.add(nombre)
+            registros = [(nombre, registro)] if registro is not None and "error" not in registro else []
+        for nombre, registro in registros:
+            resultados.append(registro)
+            nombres.append(nombre)
+            if len(resultados) == tamano_bloque:
+                yield resultados, nombres
+                resultados, nombres = [], []
+    if resultados:
+        yield resultados, nombres
+
+
+def cargar_resultados(entradas):
+    """Todos los resultados de página de las entradas (ver iterar_resultados_en_bloques)."""
+    resultados, nombres = [], []
+    for bloque, nombres_bloque in iterar_resultados_en_bloques(entradas):
+        resultados.extend(bloque)
+        nombres.extend(nombres_bloque)
+    return resultados, nombres
+
+
+def texto_grupo(resultado):
+    grupo = resultado.get("grupo_circulos")
+    if isinstance(grupo, list):
+        return "".join(str(d) if d is not None else "-" for d in grupo)
+    if isinstance(grupo, str):
+        return grupo
+    return (resultado.get("grupo") or "").strip() or "No detectado"
+
+
+def calificar_lote(resultados, nombres, clave, puntajes, detalles=False):
+    """Califica un lote completo y arma la salida (mismos campos que /grade-exams)."""
+    matriz, detectadas = matriz_respuestas(resultados, len(clave))
+    calif = calificar(matriz, clave, puntajes)
+
+    salida = []
+    for i, resultado in enumerate(resultados):
+        registro = {
+            "image_name": resultado.get("nombre_imagen") or nombres[i],
+            "matricula": (resultado.get("matricula") or "").strip() or "No detectada",
+            "grupo": texto_grupo(resultado),
+            "total_questions": int(detectadas[i]),
+            "correct_answers": int(calif["aciertos"][i]),
+            "grade": f"{calif['puntaje'][i]:.2f}",
+        }
+        if detalles:
+            respondidas = np.flatnonzero(matriz[i])
+            registro["details"] = [{
+                "question_number": int(q) + 1,
+                "user_answer": LETRAS[matriz[i, q] - 1].lower(),
+                "correct_answer": LETRAS[clave[q] - 1].lower() if clave[q] else None,
+                "is_correct": bool(calif["correctas"][i, q]),
+                "score_value": float(puntajes[q]),
+            } for q in respondidas]
+        salida.append(registro)
+
+    return {
+        "total_exams_processed": len(salida),
+        "results": salida,
+        "question_correct_rate": [round(float(x), 4) for x in calif["por_pregunta"]],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Califica un lote de hojas revisadas contra una clave")
+    parser.add_argument("entradas", nargs="+",
+                        help="Almacenes .jsonl (--store), archivos reviewed_*.json o carpetas con ellos")
+    parser.add_argument("--key", required=True, help="Clave de respuestas JSON (ver docstring del módulo)")
+    parser.add_argument("--details", action="store_true",
+                        help="Incluir el detalle por pregunta de cada alumno (más lento y más grande)")
+    args = parser.parse_args()
+
+    try:
+        clave, puntajes = cargar_clave(args.key)
+        resultados, nombres = cargar_resultados(args.entradas)
+    except (OSError, ValueError, KeyError) as e:
+        print(json.dumps({"error": str(e)}))
+        return
+
+    salida = calificar_lote(resultados, nombres, clave, puntajes, args.details)
+    sys.stdout.write(json.dumps(salida, ensure_ascii=False) + "\n")
+    sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Análisis de reactivos de un lote calificado: dificultad, discriminación
+(punto-biserial), frecuencia de cada opción (distractores) y confiabilidad
+KR-20, para el examen completo y por grupo.
+
+Trabaja sobre la matriz de respuestas de grade_answers.py y solo acumula
+sumas suficientes por bloque de alumnos, así que lotes más grandes que la
+memoria se procesan en streaming.
+
+Uso:
+    python item_analysis.py --key clave.json <lote.jsonl|reviewed_*.json|carpeta> [...] [--output reporte.json]
+"""
+import sys
+import json
+import argparse
+
+import numpy as np
+
+from grade_answers import (LETRAS, SIN_RESPUESTA, cargar_clave, matriz_respuestas, calificar,
+                           iterar_resultados_en_bloques, texto_grupo)
+
+TAMANO_BLOQUE = 10000
+
+
+class AcumuladorItems:
+    """
+    Sumas suficientes de un conjunto de alumnos (x = acierto 0/1 por
+    pregunta, t = aciertos totales del alumno): n, Σx, Σt, Σt², Σx·t y el
+    conteo de cada opción por pregunta.
+    """
+
+    def __init__(self, num_preguntas):
+        self.n = 0
+        self.suma_x = np.zeros(num_preguntas, dtype=np.int64)
+        self.suma_t = 0
+        self.suma_t2 = 0
+        self.suma_xt = np.zeros(num_preguntas, dtype=np.int64)
+        # Columna 0: sin respuesta; 1..5: A..E
+        self.opciones = np.zeros((num_preguntas, len(LETRAS) + 1), dtype=np.int64)
+
+    def agregar(self, matriz, correctas):
+        x = correctas.astype(np.int32)
+        t = x.sum(axis=1)
+        self.n += len(x)
+        self.suma_x += x.sum(axis=0)
+        self.suma_t += int(t.sum())
+        self.suma_t2 += int((t.astype(np.int64) ** 2).sum())
+        self.suma_xt += t @ x
+        for codigo in range(len(LETRAS) + 1):
+            self.opciones[:, codigo] += (matriz == codigo).sum(axis=0)
+
+    def reporte(self, clave):
+        """Estadísticos del conjunto en formato columnar (una lista por estadístico)."""
+        n = self.n
+        k = len(clave)
+        if n == 0:
+            return {"students": 0}
+        p = self.suma_x / n
+        media_t = self.suma_t / n
+        var_t = self.suma_t2 / n - media_t ** 2
+        var_x = p * (1 - p)
+
+        # Punto-biserial contra el total y contra el total sin el propio reactivo
+        cov_xt = self.suma_xt / n - p * media_t
+        media_r = media_t - p
+        var_r = (self.suma_t2 - 2 * self.suma_xt + self.suma_x) / n - media_r ** 2
+        cov_xr = (self.suma_xt - self.suma_x) / n - p * media_r
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rpb = cov_xt / np.sqrt(var_x * var_t)
+            rpb_resto = cov_xr / np.sqrt(var_x * var_r)
+
+        kr20 = None
+        if k > 1 and var_t > 0:
+            kr20 = k / (k - 1) * (1 - var_x.sum() / var_t)
+
+        frecuencias = self.opciones / n
+        return {
+            "students": n,
+            "mean_correct": _redondear(media_t),
+            "kr20": _redondear(kr20),
+            "difficulty": _lista(p),
+            "point_biserial": _lista(rpb),
+            "point_biserial_rest": _lista(rpb_resto),
+            "options": {"blank": _lista(frecuencias[:, SIN_RESPUESTA]),
+                        **{letra: _lista(frecuencias[:, i + 1]) for i, letra in enumerate(LETRAS)}},
+        }
+
+
+def _redondear(valor):
+    return None if valor is None or not np.isfinite(valor) else round(float(valor), 4)
+
+
+def _lista(arreglo):
+    return [_redondear(v) for v in arreglo]
+
+
+def analizar(entradas, clave, tamano_bloque=TAMANO_BLOQUE):
+    """Recorre las entradas por bloques y acumula el examen completo y cada grupo."""
+    examen = AcumuladorItems(len(clave))
+    grupos = {}
+    puntajes = np.ones(len(clave), dtype=np.float32)
+    for resultados, _ in iterar_resultados_en_bloques(entradas, tamano_bloque):
+        matriz, _ = matriz_respuestas(resultados, len(clave))
+        correctas = calificar(matriz, clave, puntajes)["correctas"]
+        examen.agregar(matriz, correctas)
+
+        nombres_grupo, indices = np.unique([texto_grupo(r) for r in resultados], return_inverse=True)
+        for i, grupo in enumerate(nombres_grupo.tolist()):
+            filas = indices == i
+            if grupo not in grupos:
+                grupos[grupo] = AcumuladorItems(len(clave))
+            grupos[grupo].agregar(matriz[filas], correctas[filas])
+
+    return {
+        "questions": len(clave),
+        "key": [LETRAS[c - 1] if c else None for c in clave],
+        "exam": examen.reporte(clave),
+        "grupos": {grupo: acumulador.reporte(clave) for grupo, acumulador in sorted(grupos.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Análisis de reactivos de un lote calificado")
+    parser.add_argument("entradas", nargs="+",
+                        help="Almacenes .jsonl (--store), archivos reviewed_*.json o carpetas con ellos")
+    parser.add_argument("--key", required=True, help="Clave de respuestas JSON (ver grade_answers.py)")
+    parser.add_argument("--output", default=None, help="Archivo del reporte (default: stdout)")
+    parser.add_argument("--chunk", type=int, default=TAMANO_BLOQUE,
+                        help=f"Alumnos por bloque en memoria (default: {TAMANO_BLOQUE})")
+    args = parser.parse_args()
+
+    try:
+        clave, _ = cargar_clave(args.key)
+        reporte = analizar(args.entradas, clave, args.chunk)
+    except (OSError, ValueError, KeyError) as e:
+        print(json.dumps({"error": str(e)}))
+        return
+
+    texto = json.dumps(reporte, ensure_ascii=False, separators=(",", ":"))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        sys.stdout.write(texto + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Manifiesto de ingesta de una carpeta de uploads (review_answer_sheet.py --incremental).
+
+Recuerda, por cada documento ya visto, su tamaño, fecha de modificación,
+hash, número de páginas y estado, además de las páginas que ya se revisaron
+bien. Así una nueva corrida solo revisa los documentos nuevos o cambiados y
+retoma página por página los que quedaron a medias (p. ej. tras una caída).
+Un documento que falla completo (PDF dañado, no se pueden contar sus
+páginas) no se reintenta hasta que el archivo cambie.
+El manifiesto es una base SQLite dentro de la misma carpeta y cada página se
+registra en cuanto termina.
+"""
+import os
+import time
+import sqlite3
+
+from cache_resultados import hash_archivo
+
+NOMBRE_MANIFIESTO = ".manifiesto_revision.sqlite"
+
+ESTADO_EN_PROCESO = "en_proceso"
+ESTADO_COMPLETO = "completo"
+ESTADO_ERROR = "error"  # Alguna página falló; se reintentan las que faltan
+ESTADO_FALLIDO = "fallido"  # Falló el documento completo; se reintenta solo si el archivo cambia
+
+
+class ManifiestoIngesta:
+    """Estado de ingesta de los documentos de una carpeta, por nombre de archivo."""
+
+    def __init__(self, directorio):
+        self.ruta = os.path.join(directorio, NOMBRE_MANIFIESTO)
+        self._con = sqlite3.connect(self.ruta, timeout=30)
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS documentos ("
+            " nombre TEXT PRIMARY KEY, tamano INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL,"
+            " paginas INTEGER, estado TEXT NOT NULL, actualizado REAL NOT NULL)")
+        self._con.execute(
+            "CREATE TABLE IF NOT EXISTS paginas ("
+            " nombre TEXT NOT NULL, pagina INTEGER NOT NULL, ok INTEGER NOT NULL, PRIMARY KEY (nombre, pagina))")
+        self._con.commit()
+
+    def planificar(self, rutas, contar_paginas):
+        """
+        Compara los archivos actuales con el manifiesto y decide qué revisar.
+
+        contar_paginas(ruta) -> int: número de páginas de un documento nuevo
+        o cambiado (si lanza excepción, el documento se revisa completo y el
+        error lo reporta la revisión).
+
+        Devuelve {"new", "changed", "resumed", "skipped", "failed", "removed"}
+        (listas de nombres) y "pendientes": {ruta: [páginas] o None (todas)}.
+        "failed": documentos que ya fallaron completos y no cambiaron desde
+        entonces (ni tamaño, ni fecha, ni contenido); no se vuelven a revisar.
+        """
+        plan = {"new": [], "changed": [], "resumed": [], "skipped": [], "failed": [], "removed": [],
+                "pendientes": {}}
+        vistos = set()
+        for ruta in rutas:
+            nombre = os.path.basename(ruta)
+            vistos.add(nombre)
+            st = os.stat(ruta)
+            fila = self._con.execute(
+                "SELECT tamano, mtime_ns, hash, paginas, estado FROM documentos WHERE nombre = ?", (nombre,)).fetchone()
+
+            # Mismo tamaño y mtime: se confía en el hash guardado sin releer el archivo
+            sin_tocar = fila is not None and fila[0] == st.st_size and fila[1] == st.st_mtime_ns
+            digest = fila[2] if sin_tocar else hash_archivo(ruta)
+
+            if fila is None or fila[2] != digest:
+                try:
+                    paginas = contar_paginas(ruta)
+                except Exception:
+                    paginas = None
+                self._con.execute("DELETE FROM paginas WHERE nombre = ?", (nombre,))
+                self._con.execute(
+                    "INSERT OR REPLACE INTO documentos (nombre, tamano, mtime_ns, hash, paginas, estado, actualizado)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (nombre, st.st_size, st.st_mtime_ns, digest, paginas, ESTADO_EN_PROCESO, time.time()))
+                plan["new" if fila is None else "changed"].append(nombre)
+                plan["pendientes"][ruta] = list(range(1, paginas + 1)) if paginas else None
+                continue
+
+            if not sin_tocar:
+                # Se reescribió con el mismo contenido: solo se actualiza la fecha
+                self._con.execute("UPDATE documentos SET tamano = ?, mtime_ns = ? WHERE nombre = ?",
+                                  (st.st_size, st.st_mtime_ns, nombre))
+            if fila[4] == ESTADO_COMPLETO:
+                plan["skipped"].append(nombre)
+                continue
+            if fila[4] == ESTADO_FALLIDO and sin_tocar:
+                plan["failed"].append(nombre)
+                continue
+
+            hechas = {p for (p,) in self._con.execute(
+                "SELECT pagina FROM paginas WHERE nombre = ? AND ok = 1", (nombre,))}
+            faltantes = [p for p in range(1, fila[3] + 1) if p not in hechas] if fila[3] else None
+            if faltantes == []:
+                # Todas las páginas terminaron pero no se alcanzó a cerrar el documento
+                self.marcar_documento(nombre, ESTADO_COMPLETO)
+                plan["skipped"].append(nombre)
+                continue
+            plan["resumed"].append(nombre)
+            plan["pendientes"][ruta] = faltantes
+
+        for (nombre,) in self._con.execute("SELECT nombre FROM documentos").fetchall():
+            if nombre not in vistos:
+                self._con.execute("DELETE FROM documentos WHERE nombre = ?", (nombre,))
+                self._con.execute("DELETE FROM paginas WHERE nombre = ?", (nombre,))
+                plan["removed"].append(nombre)
+        self._con.commit()
+        return plan
+
+    def marcar_pagina(self, nombre, pagina, ok):
+        self._con.execute("INSERT OR REPLACE INTO paginas (nombre, pagina, ok) VALUES (?, ?, ?)",
+                          (nombre, pagina, int(ok)))
+        self._con.commit()
+
+    def marcar_documento(self, nombre, estado):
+        self._con.execute("UPDATE documentos SET estado = ?, actualizado = ? WHERE nombre = ?",
+                          (estado, time.time(), nombre))
+        self._con.commit()
+
+    def cerrar(self):
+        self._con.close()
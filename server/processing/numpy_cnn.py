@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Inferencia del CNN de dígitos (text_detection.py) solo con NumPy.
+
+1. Exportar (una vez, donde sí haya TensorFlow):
+       python numpy_cnn.py export ai_models/number_recognition_model.h5 [--int8]
+   escribe ai_models/number_recognition_model.npz con la arquitectura (JSON)
+   y los pesos. Con --int8 los kernels se guardan cuantizados a int8 con una
+   escala por canal de salida (~4x más chico) y se vuelven float32 al cargar.
+2. Verificar que NumPy reproduce a Keras:
+       python numpy_cnn.py verify ai_models/number_recognition_model.h5 ai_models/number_recognition_model.npz
+3. En producción text_detection.get_model usa el .npz si existe, sin importar
+   TensorFlow.
+
+Capas soportadas (modelos secuenciales, datos NHWC): InputLayer, Rescaling,
+Conv2D, MaxPooling2D, AveragePooling2D, BatchNormalization, Activation, ReLU,
+Softmax, Flatten, GlobalAveragePooling2D, GlobalMaxPooling2D, Dense y las de
+regularización que en inferencia no hacen nada (Dropout, SpatialDropout2D...).
+"""
+import os
+import sys
+import json
+import argparse
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+FORMAT_VERSION = 1
+
+# Capas que en inferencia son la identidad
+_IDENTITY_LAYERS = {"InputLayer", "Dropout", "SpatialDropout2D", "GaussianNoise", "GaussianDropout", "AlphaDropout"}
+
+
+def _relu(x):
+    return np.maximum(x, 0)
+
+
+def _softmax(x):
+    e = np.exp(x - x.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": _relu,
+    "softmax": _softmax,
+    "sigmoid": _sigmoid,
+    "tanh": np.tanh,
+}
+
+
+def _same_padding(size, kernel, stride):
+    """Relleno (antes, después) de padding='same' igual que Keras/TensorFlow"""
+    out = -(-size // stride)
+    total = max((out - 1) * stride + kernel - size, 0)
+    return total // 2, total - total // 2
+
+
+def _pad(x, kernel, strides, padding, value=0.0):
+    if padding != "same":
+        return x
+    top, bottom = _same_padding(x.shape[1], kernel[0], strides[0])
+    left, right = _same_padding(x.shape[2], kernel[1], strides[1])
+    if top == bottom == left == right == 0:
+        return x
+    return np.pad(x, ((0, 0), (top, bottom), (left, right), (0, 0)), constant_values=value)
+
+
+def _windows(x, kernel, strides):
+    """Vista (N, OH, OW, C, kh, kw) de las ventanas de x (N, H, W, C), sin copiar"""
+    return sliding_window_view(x, kernel, axis=(1, 2))[:, ::strides[0], ::strides[1]]
+
+
+def conv2d(x, kernel, bias, strides=(1, 1), padding="valid"):
+    """Convolución 2D (correlación, como Keras) con kernel (kh, kw, C_in, C_out)"""
+    kh, kw = kernel.shape[:2]
+    windows = _windows(_pad(x, (kh, kw), strides, padding), (kh, kw), strides)
+    out = np.tensordot(windows, kernel, axes=([3, 4, 5], [2, 0, 1]))
+    if bias is not None:
+        out += bias
+    return out
+
+
+def pool2d(x, pool_size, strides, padding, mode):
+    if mode == "max":
+        windows = _windows(_pad(x, pool_size, strides, padding, -np.inf), pool_size, strides)
+        return windows.max(axis=(4, 5))
+    windows = _windows(_pad(x, pool_size, strides, padding), pool_size, strides)
+    sums = windows.sum(axis=(4, 5))
+    if padding != "same":
+        return sums / (pool_size[0] * pool_size[1])
+    # Keras no cuenta el relleno en el promedio
+    ones = np.ones((1,) + x.shape[1:3] + (1,), dtype=x.dtype)
+    counts = _windows(_pad(ones, pool_size, strides, padding), pool_size, strides).sum(axis=(4, 5))
+    return sums / counts
+
+
+def _quantize(kernel):
+    """int8 simétrico con una escala por canal de salida (último eje)"""
+    axes = tuple(range(kernel.ndim - 1))
+    scale = np.abs(kernel).max(axis=axes) / 127.0
+    scale[scale == 0] = 1.0
+    return np.round(kernel / scale).astype(np.int8), scale.astype(np.float32)
+
+
+def _activation_name(layer):
+    name = getattr(getattr(layer, "activation", None), "__name__", "linear")
+    if name not in ACTIVATIONS:
+        raise ValueError(f"Activación no soportada en '{layer.name}': {name}")
+    return name
+
+
+def _pair(value):
+    return tuple(value) if isinstance(value, (list, tuple)) else (value, value)
+
+
+def export_model(model_path, npz_path=None, int8=False):
+    """
+    Convierte un modelo Keras secuencial a .npz (arquitectura JSON + pesos).
+    Requiere TensorFlow/Keras solo aquí.
+
+    Returns:
+        str: Ruta del .npz escrito
+    """
+    from tensorflow import keras
+
+    if npz_path is None:
+        npz_path = os.path.splitext(model_path)[0] + ".npz"
+    model = keras.models.load_model(model_path, compile=False)
+
+    layers, arrays = [], {}
+
+    def add_kernel(i, kernel):
+        kernel = np.asarray(kernel, dtype=np.float32)
+        if int8:
+            arrays[f"{i}_kernel_q"], arrays[f"{i}_kernel_scale"] = _quantize(kernel)
+        else:
+            arrays[f"{i}_kernel"] = kernel
+
+    for layer in model.layers:
+        kind = layer.__class__.__name__
+        config = layer.get_config()
+        i = len(layers)
+        if kind in _IDENTITY_LAYERS:
+            continue
+        if kind in ("Conv2D", "Dense"):
+            if kind == "Conv2D" and (_pair(config.get("dilation_rate", 1)) != (1, 1) or config.get("groups", 1) != 1):
+                raise ValueError(f"Conv2D con dilatación o grupos no soportada: '{layer.name}'")
+            if config.get("data_format", "channels_last") != "channels_last":
+                raise ValueError(f"Solo se soporta channels_last: '{layer.name}'")
+            weights = layer.get_weights()
+            add_kernel(i, weights[0])
+            if config.get("use_bias", True):
+                arrays[f"{i}_bias"] = np.asarray(weights[1], dtype=np.float32)
+            spec = {"type": kind, "activation": _activation_name(layer)}
+            if kind == "Conv2D":
+                spec.update(strides=_pair(config["strides"]), padding=config["padding"])
+        elif kind in ("MaxPooling2D", "AveragePooling2D"):
+            pool_size = _pair(config["pool_size"])
+            spec = {"type": kind, "pool_size": pool_size,
+                    "strides": _pair(config.get("strides") or pool_size), "padding": config["padding"]}
+        elif kind == "BatchNormalization":
+            weights = dict(zip([w.name.split("/")[-1].split(":")[0] for w in layer.weights], layer.get_weights()))
+            gamma = weights.get("gamma", 1.0)
+            beta = weights.get("beta", 0.0)
+            scale = gamma / np.sqrt(weights["moving_variance"] + config["epsilon"])
+            arrays[f"{i}_scale"] = np.asarray(scale, dtype=np.float32)
+            arrays[f"{i}_shift"] = np.asarray(beta - weights["moving_mean"] * scale, dtype=np.float32)
+            spec = {"type": kind}
+        elif kind == "Rescaling":
+            spec = {"type": kind, "scale": float(config["scale"]), "offset": float(config["offset"])}
+        elif kind == "Activation":
+            spec = {"type": kind, "activation": _activation_name(layer)}
+        elif kind == "ReLU":
+            if config.get("max_value") is not None or config.get("negative_slope") or config.get("threshold"):
+                raise ValueError(f"ReLU con parámetros no soportada: '{layer.name}'")
+            spec = {"type": "Activation", "activation": "relu"}
+        elif kind == "Softmax":
+            spec = {"type": "Activation", "activation": "softmax"}
+        elif kind in ("Flatten", "GlobalAveragePooling2D", "GlobalMaxPooling2D"):
+            spec = {"type": kind}
+        else:
+            raise ValueError(f"Capa no soportada: {kind} ('{layer.name}')")
+        layers.append(spec)
+
+    architecture = {"version": FORMAT_VERSION, "input_shape": list(model.input_shape[1:]), "layers": layers,
+                    "int8": bool(int8)}
+    np.savez_compressed(npz_path, architecture=np.array(json.dumps(architecture)), **arrays)
+    return npz_path
+
+
+class NumpyCNN:
+    """
+    Modelo exportado con export_model. Ofrece predict_on_batch y predict
+    como un modelo Keras, así que text_detection lo usa sin cambios.
+    """
+
+    def __init__(self, npz_path):
+        with np.load(npz_path, allow_pickle=False) as data:
+            architecture = json.loads(str(data["architecture"]))
+            if architecture.get("version") != FORMAT_VERSION:
+                raise ValueError(f"Versión de modelo .npz no soportada: {architecture.get('version')}")
+            self.input_shape = tuple(architecture["input_shape"])
+            self.layers = []
+            for i, spec in enumerate(architecture["layers"]):
+                params = {}
+                if f"{i}_kernel_q" in data:
+                    params["kernel"] = data[f"{i}_kernel_q"].astype(np.float32) * data[f"{i}_kernel_scale"]
+                elif f"{i}_kernel" in data:
+                    params["kernel"] = data[f"{i}_kernel"]
+                for name in ("bias", "scale", "shift"):
+                    if f"{i}_{name}" in data:
+                        params[name] = data[f"{i}_{name}"]
+                self.layers.append((spec, params))
+
+    def predict_on_batch(self, x):
+        x = np.asarray(x, dtype=np.float32)
+        for spec, params in self.layers:
+            kind = spec["type"]
+            if kind == "Conv2D":
+                x = ACTIVATIONS[spec["activation"]](
+                    conv2d(x, params["kernel"], params.get("bias"), tuple(spec["strides"]), spec["padding"]))
+            elif kind == "Dense":
+                x = x @ params["kernel"]
+                if "bias" in params:
+                    x = x + params["bias"]
+                x = ACTIVATIONS[spec["activation"]](x)
+            elif kind in ("MaxPooling2D", "AveragePooling2D"):
+                x = pool2d(x, tuple(spec["pool_size"]), tuple(spec["strides"]), spec["padding"],
+                           "max" if kind == "MaxPooling2D" else "average")
+            elif kind == "BatchNormalization":
+                x = x * params["scale"] + params["shift"]
+            elif kind == "Rescaling":
+                x = x * spec["scale"] + spec["offset"]
+            elif kind == "Activation":
+                x = ACTIVATIONS[spec["activation"]](x)
+            elif kind == "Flatten":
+                x = x.reshape(len(x), -1)
+            elif kind == "GlobalAveragePooling2D":
+                x = x.mean(axis=(1, 2))
+            elif kind == "GlobalMaxPooling2D":
+                x = x.max(axis=(1, 2))
+        return x
+
+    def predict(self, x, verbose=0, batch_size=None):
+        return self.predict_on_batch(x)
+
+
+def verify(model_path, npz_path, samples=64, seed=0):
+    """
+    Compara Keras contra NumPy con entradas aleatorias tipo cuadro (fondo
+    blanco con trazos). Devuelve {"max_abs_diff", "argmax_agreement"}.
+    """
+    from tensorflow import keras
+
+    keras_model = keras.models.load_model(model_path, compile=False)
+    numpy_model = NumpyCNN(npz_path)
+    rng = np.random.default_rng(seed)
+    x = np.ones((samples,) + numpy_model.input_shape, dtype=np.float32)
+    x -= (rng.random(x.shape) < 0.15) * rng.random(x.shape).astype(np.float32)
+    expected = np.asarray(keras_model.predict_on_batch(x))
+    actual = numpy_model.predict_on_batch(x)
+    return {
+        "samples": samples,
+        "max_abs_diff": float(np.abs(expected - actual).max()),
+        "argmax_agreement": float((expected.argmax(axis=-1) == actual.argmax(axis=-1)).mean()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta y verifica el CNN de dígitos para inferencia solo con NumPy")
+    sub = parser.add_subparsers(dest="command", required=True)
+    exp = sub.add_parser("export", help="Convierte el modelo Keras (.h5) a .npz")
+    exp.add_argument("model", help="Modelo Keras (.h5 / .keras)")
+    exp.add_argument("output", nargs="?", default=None, help="Archivo .npz (default: junto al modelo)")
+    exp.add_argument("--int8", action="store_true", help="Guardar kernels cuantizados a int8 (escala por canal)")
+    ver = sub.add_parser("verify", help="Compara las predicciones de Keras y NumPy")
+    ver.add_argument("model", help="Modelo Keras (.h5 / .keras)")
+    ver.add_argument("npz", help="Modelo exportado (.npz)")
+    ver.add_argument("--samples", type=int, default=64)
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            salida = {"npz": export_model(args.model, args.output, args.int8)}
+        else:
+            salida = verify(args.model, args.npz, args.samples)
+    except (OSError, ValueError, ImportError) as e:
+        salida = {"error": str(e)}
+    sys.stdout.write(json.dumps(salida, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Perfilado opcional de la revisión (review_answer_sheet.py --profile o
+REVIEW_PROFILE=1): tiempo de cada etapa por página y conteo de círculos por
+bloque, más un resumen de toda la corrida.
+
+Un perfil es un dict que la visión va llenando:
+    {"stages_ms": {"rasterize": 41.2, "threshold": 12.0, ...},
+     "blocks": {"respuestas": {"hough_candidates": 104, "circles": 100, "hough_ms": 9.1, ...}}}
+Sin perfil (None) el código de visión no toma ningún tiempo.
+"""
+import time
+
+import numpy as np
+
+
+def nuevo_perfil():
+    return {"stages_ms": {}, "blocks": {}}
+
+
+def registrar_etapa(perfil, etapa, inicio, bloque=None):
+    """Suma a la etapa (y al bloque, si se da) los ms desde inicio. Devuelve el instante actual."""
+    ahora = time.perf_counter()
+    ms = (ahora - inicio) * 1000
+    perfil["stages_ms"][etapa] = perfil["stages_ms"].get(etapa, 0.0) + ms
+    if bloque is not None:
+        datos = perfil["blocks"].setdefault(bloque, {})
+        datos[f"{etapa}_ms"] = datos.get(f"{etapa}_ms", 0.0) + ms
+    return ahora
+
+
+def registrar_conteo(perfil, bloque, nombre, valor):
+    perfil["blocks"].setdefault(bloque, {})[nombre] = int(valor)
+
+
+def cerrar_perfil(perfil):
+    """Perfil listo para el JSON del resultado: ms redondeados y total de la página."""
+    etapas = {etapa: round(ms, 3) for etapa, ms in perfil["stages_ms"].items()}
+    bloques = {tipo: {k: round(v, 3) if isinstance(v, float) else v for k, v in datos.items()}
+               for tipo, datos in perfil["blocks"].items()}
+    return {"stages_ms": etapas, "total_ms": round(sum(perfil["stages_ms"].values()), 3), "blocks": bloques}
+
+
+def _estadisticos(valores):
+    valores = np.asarray(valores, dtype=np.float64)
+    return {
+        "total": round(float(valores.sum()), 3),
+        "mean": round(float(valores.mean()), 3),
+        "p50": round(float(np.percentile(valores, 50)), 3),
+        "p95": round(float(np.percentile(valores, 95)), 3),
+    }
+
+
+class AcumuladorPerfil:
+    """Junta los perfiles de las páginas de una corrida para su resumen."""
+
+    def __init__(self):
+        self.paginas = 0
+        self.etapas = {}
+        self.totales = []
+        self.bloques = {}
+
+    def agregar(self, resultado):
+        perfil = resultado.get("profile")
+        if not perfil:
+            return
+        self.paginas += 1
+        self.totales.append(perfil["total_ms"])
+        for etapa, ms in perfil["stages_ms"].items():
+            self.etapas.setdefault(etapa, []).append(ms)
+        for tipo, datos in perfil["blocks"].items():
+            for nombre, valor in datos.items():
+                self.bloques.setdefault(tipo, {}).setdefault(nombre, []).append(valor)
+
+    def reporte(self):
+        """
+        {"pages", "total_ms", "stages_ms": {etapa: {total, mean, p50, p95}},
+         "blocks": {tipo: {nombre: {...}}}}. Las etapas que no ocurren en todas
+        las páginas (p. ej. rasterize en imágenes) promedian solo donde ocurren.
+        """
+        if self.paginas == 0:
+            return {"pages": 0}
+        return {
+            "pages": self.paginas,
+            "total_ms": _estadisticos(self.totales),
+            "stages_ms": {etapa: _estadisticos(valores) for etapa, valores in self.etapas.items()},
+            "blocks": {tipo: {nombre: _estadisticos(valores) for nombre, valores in datos.items()}
+                       for tipo, datos in self.bloques.items()},
+        }
@@ -4,11 +4,45 @@ import cv2
 import json
 import numpy as np
 import math
-from pdf2image import convert_from_path
+import functools
+import glob
+import time
+import argparse
+import threading
+import socketserver
+import hashlib
+import multiprocessing
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from cache_resultados import CacheResultados, clave_pagina
+from manifiesto_ingesta import ManifiestoIngesta, ESTADO_COMPLETO, ESTADO_ERROR, ESTADO_FALLIDO
+from almacen_resultados import AlmacenResultados, nombre_pagina, nombre_imagen
+from geometria import fusionar_circulos, agrupar_en_filas
+from perfil_revision import nuevo_perfil, registrar_etapa, registrar_conteo, cerrar_perfil, AcumuladorPerfil
+
+try:
+    import pymupdf as fitz  # PyMuPDF >= 1.24
+except ImportError:
+    try:
+        import fitz  # PyMuPDF (nombre antiguo)
+    except ImportError:
+        fitz = None
 
 # ----------------- Configuración CV -----------------
 MIN_RECT_AREA = 100
+PDF_DPI = 200  # Mismo valor por defecto que pdf2image
+PIRAMIDE_REDUCCION = 4  # Escala de la imagen donde el modo pirámide busca los bloques
+# Confianza por fila (mejor burbuja contra la segunda)
+UMBRAL_MARCA = 200  # Score (calcular_scores_bloque) desde el que una burbuja cuenta como marcada
+MARGEN_MINIMO = 0.5  # Margen relativo (mejor - segunda) / mejor por debajo del cual la fila es dudosa
+# Cascada: vía rápida sobre una rejilla fija a baja resolución
+CASCADA_REDUCCION = 2  # Escala de la imagen que muestrea la vía rápida
+RAPIDO_MARCA = 40  # Oscuridad sobre la mediana del bloque desde la que la vía rápida ve una marca
+RAPIDO_MARCA_SEGURA = 80  # La vía rápida solo resuelve filas cuya marca supera esta oscuridad
+RAPIDO_TOLERANCIA_FORMA = 0.15  # Diferencia máxima de proporción entre el bloque detectado y la plantilla
 DEBUG = False  # Pon en False para producción para no ensuciar el stdout
+# Tiempos por etapa en cada resultado (--profile); sin él la visión no mide nada
+PERFILAR = os.environ.get("REVIEW_PROFILE", "") not in ("", "0")
 # ----------------------------------------------------
 
 # ==========================================
@@ -16,25 +50,8 @@ DEBUG = False  # Pon en False para producción para no ensuciar el stdout
 # ==========================================
 
 def filtrar_circulos_superpuestos(circles, min_dist_threshold=20):
-    if not circles: return []
-    filtered = []
-    circles = sorted(circles, key=lambda c: c[0][0])
-    processed = [False] * len(circles)
-    for i in range(len(circles)):
-        if processed[i]: continue
-        group = [circles[i]]
-        processed[i] = True
-        for j in range(i+1, len(circles)):
-            if processed[j]: continue
-            dist = math.hypot(circles[i][0][0]-circles[j][0][0], circles[i][0][1]-circles[j][0][1])
-            if dist < min_dist_threshold:
-                group.append(circles[j])
-                processed[j] = True
-        avg_x = int(np.mean([c[0][0] for c in group]))
-        avg_y = int(np.mean([c[0][1] for c in group]))
-        avg_r = int(np.mean([c[1] for c in group]))
-        filtered.append(((avg_x, avg_y), avg_r))
-    return filtered
+    """Fusiona los círculos de Hough repetidos (ver geometria.fusionar_circulos)."""
+    return fusionar_circulos(circles, min_dist_threshold)
 
 _clahe_score = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
 
@@ -63,20 +80,11 @@ def calcular_score_marca_mejor(gray, centro, radio):
 
 def agrupar_filas(circulos, expected_rows, radio_prom):
     if not circulos: return [[] for _ in range(expected_rows)]
-    
-    circulos.sort(key=lambda c: c[0][1]) # Ordenar por Y
-    filas = []
-    fila_actual = [circulos[0]]
-    
+
+    # Filas: orden por Y y corte donde el salto entre centros consecutivos es grande
     umbral_salto = radio_prom * 1.8
-    
-    for i in range(1, len(circulos)):
-        if abs(circulos[i][0][1] - fila_actual[-1][0][1]) < umbral_salto:
-            fila_actual.append(circulos[i])
-        else:
-            filas.append(sorted(fila_actual, key=lambda c: c[0][0]))
-            fila_actual = [circulos[i]]
-    filas.append(sorted(fila_actual, key=lambda c: c[0][0]))
+    indices = agrupar_en_filas([c[0] for c in circulos], umbral_salto)
+    filas = [[circulos[i] for i in fila] for fila in indices]
 
     # Si hay más filas de las esperadas, nos quedamos con las más pobladas/prominentes
     if len(filas) > expected_rows:
@@ -89,11 +97,98 @@ def agrupar_filas(circulos, expected_rows, radio_prom):
         
     return filas
 
+@functools.lru_cache(maxsize=64)
+def _mascara_circular(radio):
+    """Máscara (2r x 2r) del círculo central usado en el score, igual que en calcular_score_marca_mejor."""
+    lado = 2 * radio
+    mask = np.zeros((lado, lado), dtype=np.uint8)
+    cv2.circle(mask, (radio, radio), int(max(1, 0.7 * radio)), 255, -1)
+    mask = mask.astype(bool)
+    mask.flags.writeable = False
+    return mask
+
+def _umbral_otsu_lote(parches):
+    """
+    Umbral de Otsu de cada parche de un arreglo (n, h, w) uint8, con el mismo
+    criterio que cv2.THRESH_OTSU (primer máximo de la varianza entre clases).
+    """
+    n = parches.shape[0]
+    planos = parches.reshape(n, -1).astype(np.int64)
+    hist = np.bincount((planos + (np.arange(n)[:, None] * 256)).ravel(), minlength=256 * n)
+    hist = hist.reshape(n, 256) / planos.shape[1]
+    q1 = np.cumsum(hist, axis=1)
+    m1 = np.cumsum(hist * np.arange(256), axis=1)
+    q2 = 1.0 - q1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma = q1 * q2 * (m1 / q1 - (m1[:, -1:] - m1) / q2) ** 2
+    eps = np.finfo(np.float32).eps
+    valido = (np.minimum(q1, q2) >= eps) & (np.maximum(q1, q2) <= 1.0 - eps)
+    sigma = np.where(valido, sigma, 0.0)
+    return np.where(sigma.max(axis=1) > 0, np.argmax(sigma, axis=1), 0)
+
+def calcular_scores_bloque(gray, candidatos):
+    """
+    Versión vectorizada de calcular_score_marca_mejor para todo un bloque.
+
+    candidatos: matriz filas x columnas de ((x, y), r) en coordenadas de la
+    página, o None en filas sin círculos. Devuelve un ndarray float con el
+    score de cada burbuja (NaN en filas vacías).
+
+    Las burbujas se recortan con indexado NumPy y se acomodan en un mosaico
+    filas x columnas; el CLAHE se aplica una sola vez a ese mosaico (solo los
+    píxeles de burbujas, no el papel del bloque). Otsu, intensidad media y
+    proporción de píxeles oscuros se calculan para todas las burbujas del
+    mismo radio a la vez.
+    """
+    filas = len(candidatos)
+    cols = max((len(f) for f in candidatos if f), default=0)
+    scores = np.full((filas, cols), np.nan)
+    if cols == 0:
+        return scores
+
+    cx = np.zeros((filas, cols), dtype=np.int64)
+    cy = np.zeros((filas, cols), dtype=np.int64)
+    radios = np.zeros((filas, cols), dtype=np.int64)
+    for i, fila in enumerate(candidatos):
+        for j, c in enumerate(fila or []):
+            cx[i, j], cy[i, j], radios[i, j] = int(c[0][0]), int(c[0][1]), max(int(c[1]), 1)
+    presentes = radios > 0
+
+    # Recortes de lado 2R centrados en cada burbuja; fuera de la página se replica el borde
+    r_max = int(radios.max())
+    lado = 2 * r_max
+    desplazamiento = np.arange(lado) - r_max
+    ys = np.clip(cy[:, :, None] + desplazamiento, 0, gray.shape[0] - 1)
+    xs = np.clip(cx[:, :, None] + desplazamiento, 0, gray.shape[1] - 1)
+    parches = gray[ys[:, :, :, None], xs[:, :, None, :]]
+    parches[~presentes] = 255
+
+    mosaico = np.ascontiguousarray(parches.transpose(0, 2, 1, 3).reshape(filas * lado, cols * lado))
+    mosaico = _clahe_score.apply(mosaico)
+    parches = mosaico.reshape(filas, lado, cols, lado).transpose(0, 2, 1, 3)
+
+    for radio in np.unique(radios[presentes]):
+        radio = int(radio)
+        fi, co = np.nonzero(radios == radio)
+        grupo = parches[fi, co, r_max - radio:r_max + radio, r_max - radio:r_max + radio]
+
+        mask = _mascara_circular(radio)
+        area = mask.sum()
+        media = grupo[:, mask].mean(axis=1)
+        umbral = _umbral_otsu_lote(grupo)
+        oscuros = (grupo[:, mask] <= umbral[:, None]).sum(axis=1)
+
+        # Misma fórmula que calcular_score_marca_mejor
+        scores[fi, co] = (oscuros / area) * 3000 + (255.0 - media) * 5.0
+    return scores
+
 def procesar_bloque(gray, bloque, config):
     """
     Procesa un bloque (Matrícula, Grupo o Respuestas) y devuelve:
     - resultados_fila: Lista de valores (índices o letras)
     - ganadores: Datos para debug/visualización (no usado en JSON final, pero útil internamente)
+
+    La matriz completa de scores (filas x columnas) queda en bloque["scores"].
     """
     circulos = bloque["circulos"]
     filas_exp = config["filas"]
@@ -111,13 +206,11 @@ def procesar_bloque(gray, bloque, config):
     min_x, max_x = min(all_x), max(all_x)
     espaciado_x = (max_x - min_x) / (cols_exp - 1) if cols_exp > 1 else 0
 
-    resultados_fila = []
-    ganadores = []
-
-    for fila_idx, fila in enumerate(filas):
+    candidatos_bloque = []
+    for fila in filas:
         candidatos = []
         if not fila:
-            resultados_fila.append(None)
+            candidatos_bloque.append(None)
             continue
         
         mapa_cols = {int(round((c[0][0] - min_x) / (espaciado_x + 1e-9))): c for c in fila}
@@ -127,25 +220,29 @@ def procesar_bloque(gray, bloque, config):
                 candidatos.append(mapa_cols[col])
             else:
                 # Interpolación simple si falta un círculo
-                if len(fila) > 0:
-                    puntos_y = [c[0][1] for c in fila]
-                    pred_y = int(np.mean(puntos_y))
-                    candidatos.append(((int(min_x + col * espaciado_x), pred_y), radio_prom))
-        
-        scores = [calcular_score_marca_mejor(gray, c[0], c[1]) for c in candidatos]
-        
+                puntos_y = [c[0][1] for c in fila]
+                pred_y = int(np.mean(puntos_y))
+                candidatos.append(((int(min_x + col * espaciado_x), pred_y), radio_prom))
+        candidatos_bloque.append(candidatos)
+
+    scores = calcular_scores_bloque(gray, candidatos_bloque)
+    bloque["scores"] = scores
+    return _decidir_filas(candidatos_bloque, scores, tipo)
+
+def _decidir_filas(candidatos_bloque, scores, tipo):
+    resultados_fila = []
+    ganadores = []
+
+    for fila_idx, candidatos in enumerate(candidatos_bloque):
         # Lógica de decisión (threshold simple relativo)
-        if not scores:
+        if not candidatos:
             resultados_fila.append(None)
             continue
             
-        best_idx = int(np.argmax(scores))
-        # Opcional: Verificar si la diferencia con el segundo es suficiente
-        # sorted_scores = sorted(scores, reverse=True)
-        # if len(sorted_scores) > 1 and (sorted_scores[0] - sorted_scores[1] < 50): best_idx = -1
+        best_idx = int(np.argmax(scores[fila_idx]))
+        # La diferencia con la segunda burbuja se reporta aparte (ver _confianza_filas)
 
         if best_idx != -1:
-            elegido = candidatos[best_idx]
             if tipo in ["matricula", "grupo"]:
                 valor = best_idx # 0-9
                 resultados_fila.append(valor)
@@ -159,13 +256,169 @@ def procesar_bloque(gray, bloque, config):
 
     return resultados_fila, ganadores
 
+def _confianza_filas(scores, umbral_marca):
+    """
+    Confianza de cada fila de una matriz de scores: margen relativo entre la
+    mejor burbuja y la segunda, "blank" si ninguna llega a umbral_marca y
+    "multi" si dos o más llegan. None en filas sin burbujas.
+    """
+    confianza = []
+    for fila in scores:
+        fila = fila[~np.isnan(fila)]
+        if fila.size == 0:
+            confianza.append(None)
+            continue
+        ordenados = np.sort(fila)[::-1]
+        mejor = float(ordenados[0])
+        segunda = max(float(ordenados[1]), 0.0) if fila.size > 1 else 0.0
+        confianza.append({
+            "margin": round((mejor - segunda) / mejor, 3) if mejor > 0 else 0.0,
+            "blank": mejor < umbral_marca,
+            "multi": segunda >= umbral_marca
+        })
+    return confianza
+
+def _fila_dudosa(confianza):
+    return confianza is None or confianza["blank"] or confianza["multi"] or confianza["margin"] < MARGEN_MINIMO
+
+# ==========================================
+#       LAYOUT (generate_answer_sheet.py)
+# ==========================================
+
+LAYOUT_VERSIONES_SOPORTADAS = (1, 2)
+PX_POR_PUNTO = PDF_DPI / 72  # Escala del marco canónico (puntos PDF -> píxeles)
+
+def cargar_layout(ruta):
+    """Lee el layout JSON que escribe generate_answer_sheet.py y valida su versión."""
+    with open(ruta, encoding="utf-8") as f:
+        layout = json.load(f)
+    if layout.get("version") not in LAYOUT_VERSIONES_SOPORTADAS:
+        raise ValueError(f"Versión de layout no soportada: {layout.get('version')}")
+    return layout
+
+def _centro_fiducial(gray, x, y, w, h):
+    """Centro sub-píxel (centroide de la tinta) de una marca dentro de un ROI a resolución completa."""
+    x, y = max(x, 0), max(y, 0)
+    roi = gray[y:y+h, x:x+w]
+    if roi.size == 0:
+        return None
+    _, binaria = cv2.threshold(roi, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    m = cv2.moments(binaria, binaryImage=True)
+    if m["m00"] == 0:
+        return None
+    return x + m["m10"] / m["m00"], y + m["m01"] / m["m00"]
+
+def registrar_hoja(gray, layout, reduccion=4):
+    """
+    Busca las 4 marcas de registro del layout (v2+) en una versión reducida de
+    la página y endereza la hoja con una sola transformación de perspectiva al
+    marco canónico: puntos PDF del layout x PX_POR_PUNTO. Devuelve la imagen
+    canónica o None si no aparecen las cuatro marcas (p. ej. hojas v1).
+    """
+    fiduciales = layout.get("fiducials")
+    if not fiduciales:
+        return None
+    ancho_pt, alto_pt = layout["page_size"]
+    h, w = gray.shape
+
+    pequena = cv2.resize(gray, (w // reduccion, h // reduccion), interpolation=cv2.INTER_AREA)
+    _, binaria = cv2.threshold(pequena, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    contornos, _ = cv2.findContours(binaria, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Área esperada de una marca en la imagen reducida, según el ancho de la página
+    lado_esperado = fiduciales["size"] * (w / ancho_pt) / reduccion
+    area_esperada = lado_esperado ** 2
+    candidatos = []
+    for c in contornos:
+        area = cv2.contourArea(c)
+        if not (0.4 * area_esperada <= area <= 2.5 * area_esperada):
+            continue
+        x, y, bw, bh = cv2.boundingRect(c)
+        if not (0.6 <= bw / bh <= 1.6) or area / (bw * bh) < 0.7:
+            continue
+        candidatos.append((x + bw / 2, y + bh / 2, (x, y, bw, bh)))
+    if len(candidatos) < 4:
+        return None
+
+    # La marca de cada esquina es el candidato más cercano a esa esquina
+    esquinas_img = ((0, 0), (w / reduccion, 0), (w / reduccion, h / reduccion), (0, h / reduccion))
+    origen = []
+    for ex, ey in esquinas_img:
+        cx, cy, (x, y, bw, bh) = min(candidatos, key=lambda cand: math.hypot(cand[0] - ex, cand[1] - ey))
+        if math.hypot(cx - ex, cy - ey) > 0.25 * math.hypot(w, h) / reduccion:
+            return None
+        margen = max(bw, bh) // 2 + 1
+        centro = _centro_fiducial(gray, (x - margen) * reduccion, (y - margen) * reduccion,
+                                  (bw + 2 * margen) * reduccion, (bh + 2 * margen) * reduccion)
+        if centro is None:
+            return None
+        origen.append(centro)
+
+    destino = np.array(fiduciales["centers"], dtype=np.float32) * PX_POR_PUNTO
+    homografia = cv2.getPerspectiveTransform(np.array(origen, dtype=np.float32), destino)
+    tamano = (int(round(ancho_pt * PX_POR_PUNTO)), int(round(alto_pt * PX_POR_PUNTO)))
+    return cv2.warpPerspective(gray, homografia, tamano, flags=cv2.INTER_LINEAR, borderValue=255)
+
+def bloques_desde_layout(layout):
+    """Bloques en el marco canónico: rectángulos del layout escalados, sin detección de contornos."""
+    bloques = {}
+    for tipo, bloque_layout in layout["blocks"].items():
+        x, y, w, h = (v * PX_POR_PUNTO for v in bloque_layout["rect"])
+        bloques[tipo] = {"bbox": (int(round(x)), int(round(y)), int(round(w)), int(round(h))),
+                         "esquinas": np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], dtype=np.float32)}
+    return bloques
+
+def _esquinas_bloque(bloque):
+    """
+    Esquinas (sup-izq, sup-der, inf-der, inf-izq) del rectángulo detectado.
+    Se usa el polígono aproximado del contorno y no el boundingRect, porque
+    los números de columna impresos sobre el borde lo agrandan.
+    """
+    if "esquinas" in bloque:
+        return bloque["esquinas"]
+    contorno = bloque.get("contorno")
+    if contorno is not None:
+        aprox = cv2.approxPolyDP(contorno, 0.02 * cv2.arcLength(contorno, True), True).reshape(-1, 2)
+        if len(aprox) == 4:
+            aprox = aprox.astype(np.float32)
+            suma, resta = aprox.sum(axis=1), aprox[:, 0] - aprox[:, 1]
+            return np.array([aprox[np.argmin(suma)], aprox[np.argmax(resta)],
+                             aprox[np.argmax(suma)], aprox[np.argmin(resta)]], dtype=np.float32)
+    x, y, w, h = bloque["bbox"]
+    return np.array([[x, y], [x + w, y], [x + w, y + h], [x, y + h]], dtype=np.float32)
+
+def candidatos_desde_layout(bloque, bloque_layout, pagina=1):
+    """
+    Proyecta las burbujas del layout (puntos PDF) sobre el rectángulo del bloque
+    detectado en la imagen y devuelve la matriz filas x columnas de ((x, y), r)
+    en píxeles, lista para calcular_scores_bloque. Las filas que el layout
+    coloca en otra página quedan en None.
+    """
+    rx, ry, rw, rh = bloque_layout["rect"]
+    origen = np.array([[rx, ry], [rx + rw, ry], [rx + rw, ry + rh], [rx, ry + rh]], dtype=np.float32)
+    destino = _esquinas_bloque(bloque)
+    homografia = cv2.getPerspectiveTransform(origen, destino)
+    escala = math.sqrt(cv2.contourArea(destino) / (rw * rh))
+
+    paginas = bloque_layout.get("pages") or [1] * len(bloque_layout["bubbles"])
+    burbujas = np.array(bloque_layout["bubbles"], dtype=np.float32)
+    centros = cv2.perspectiveTransform(burbujas[:, :, :2].reshape(-1, 1, 2), homografia).reshape(burbujas.shape[0], -1, 2)
+    candidatos = []
+    for fila, centros_fila, pagina_fila in zip(burbujas, centros, paginas):
+        if pagina_fila != pagina:
+            candidatos.append(None)
+            continue
+        candidatos.append([((int(round(cx)), int(round(cy))), max(1, int(round(r * escala))))
+                           for (cx, cy), r in zip(centros_fila, fila[:, 2])])
+    return candidatos
+
 def asignar_bloques_espacial(rect_contours):
     if len(rect_contours) < 3: return {}
     
     rects = []
     for c in rect_contours:
         x, y, w, h = cv2.boundingRect(c)
-        rects.append({"bbox": (x, y, w, h)})
+        rects.append({"bbox": (x, y, w, h), "contorno": c})
 
     # 1. Ordenar por Y (arriba a abajo)
     rects.sort(key=lambda r: r["bbox"][1])
@@ -184,28 +437,284 @@ def asignar_bloques_espacial(rect_contours):
 
     return {"matricula": matricula, "grupo": grupo, "respuestas": respuestas}
 
-def procesar_examen_completo(image_path, num_questions=20):
+def _contornos_rectangulares(gray, area_min=MIN_RECT_AREA, tam_bloque=19, suavizar=True, perfil=None):
+    """Contornos externos de 4 vértices con área mayor a area_min."""
+    inicio = time.perf_counter() if perfil is not None else None
+    blurred = cv2.GaussianBlur(gray, (5,5), 0) if suavizar else gray
+    thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, tam_bloque, 3)
+    if perfil is not None:
+        inicio = registrar_etapa(perfil, "threshold", inicio)
+
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    rectangulos = [c for c in contours if len(cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True)) == 4 and cv2.contourArea(c) > area_min]
+    if perfil is not None:
+        registrar_etapa(perfil, "contours", inicio)
+    return rectangulos
+
+def detectar_bloques(gray, perfil=None):
+    """Busca los 3 bloques en la página completa. Devuelve None si no aparecen."""
+    rectangle_contours = _contornos_rectangulares(gray, perfil=perfil)
+    if len(rectangle_contours) < 3:
+        return None
+
+    # Los 3 bloques son los rectángulos más grandes; así se descartan las
+    # marcas de registro y cualquier recuadro pequeño de ruido
+    rectangle_contours = sorted(rectangle_contours, key=cv2.contourArea, reverse=True)[:3]
+    return asignar_bloques_espacial(rectangle_contours)
+
+def _contorno_en_marco(gray, esquinas, margen):
     """
-    Función maestra que ejecuta toda la lógica de visión y devuelve
-    los datos estructurados.
+    Contorno exacto (resolución completa) de un recuadro cuyas esquinas se
+    conocen con error < margen. Solo se umbraliza una banda de ancho
+    2*margen a lo largo de los cuatro lados; el interior queda en blanco.
+    """
+    h, w = gray.shape
+    esquinas = np.round(esquinas).astype(np.int32)
+    x0, y0 = np.maximum(esquinas.min(axis=0) - margen, 0)
+    x1, y1 = np.minimum(esquinas.max(axis=0) + margen + 1, (w, h))
+    binaria = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+
+    # Cada lado se umbraliza en su propio rectángulo, con un borde extra para
+    # no cambiar el resultado del umbral adaptativo (ventana 19) cerca de la línea
+    extra = 2 * margen
+    for p, q in zip(esquinas, np.roll(esquinas, -1, axis=0)):
+        fx0, fy0 = np.maximum(np.minimum(p, q) - margen, (x0, y0))
+        fx1, fy1 = np.minimum(np.maximum(p, q) + margen + 1, (x1, y1))
+        ex0, ey0 = max(fx0 - extra, 0), max(fy0 - extra, 0)
+        ex1, ey1 = min(fx1 + extra, w), min(fy1 + extra, h)
+        blurred = cv2.GaussianBlur(gray[ey0:ey1, ex0:ex1], (5,5), 0)
+        thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 19, 3)
+        binaria[fy0-y0:fy1-y0, fx0-x0:fx1-x0] = thresh[fy0-ey0:fy1-ey0, fx0-ex0:fx1-ex0]
+
+    banda = np.zeros_like(binaria)
+    cv2.polylines(banda, [esquinas - (x0, y0)], True, 255, thickness=2 * margen + 1)
+    binaria &= banda
+
+    contours, _ = cv2.findContours(binaria, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x0), int(y0)))
+    cuadros = [c for c in contours if len(cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True)) == 4 and cv2.contourArea(c) > MIN_RECT_AREA]
+    return max(cuadros, key=cv2.contourArea) if cuadros else None
+
+def detectar_bloques_piramide(gray, reduccion=PIRAMIDE_REDUCCION, perfil=None):
+    """
+    Igual que detectar_bloques, pero los bloques se localizan en una copia a
+    1/reduccion de escala y el contorno exacto se vuelve a buscar a resolución
+    completa solo sobre el borde de cada bloque. Si la versión reducida no encuentra
+    los 3 bloques se usa la búsqueda en la página completa.
+    """
+    inicio = time.perf_counter() if perfil is not None else None
+    h, w = gray.shape
+    pequena = cv2.resize(gray, (w // reduccion, h // reduccion), interpolation=cv2.INTER_AREA)
+    if perfil is not None:
+        registrar_etapa(perfil, "resize", inicio)
+    # Ventana del umbral adaptativo escalada a la imagen reducida (impar, >= 3).
+    # INTER_AREA ya promedia; otro desenfoque pegaría las etiquetas al recuadro
+    tam_bloque = max(3, (19 // reduccion) | 1)
+    rectangle_contours = _contornos_rectangulares(pequena, MIN_RECT_AREA / reduccion ** 2, tam_bloque, suavizar=False,
+                                                  perfil=perfil)
+    if len(rectangle_contours) < 3:
+        return detectar_bloques(gray, perfil)
+    rectangle_contours = sorted(rectangle_contours, key=cv2.contourArea, reverse=True)[:3]
+
+    inicio = time.perf_counter() if perfil is not None else None
+    refinados = []
+    for c in rectangle_contours:
+        esquinas = cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True).reshape(-1, 2)
+        contorno = _contorno_en_marco(gray, (esquinas + 0.5) * reduccion, 3 * reduccion)
+        refinados.append(contorno if contorno is not None else c * reduccion)
+    if perfil is not None:
+        registrar_etapa(perfil, "refine", inicio)
+    return asignar_bloques_espacial(refinados)
+
+@functools.lru_cache(maxsize=8)
+def plantilla_por_defecto(num_preguntas):
+    """
+    Layout de la hoja estándar de generate_answer_sheet.py para num_preguntas:
+    la rejilla fija que usa la vía rápida de la cascada cuando no se da --layout.
     """
+    from generate_answer_sheet import calcular_layout  # reportlab solo hace falta con la cascada
+    return calcular_layout(num_preguntas)
+
+def _forma_coincide(bloque, bloque_layout):
+    """El bloque detectado tiene la proporción del rectángulo de la plantilla (misma hoja)."""
+    esquinas = _esquinas_bloque(bloque)
+    ancho = (np.linalg.norm(esquinas[1] - esquinas[0]) + np.linalg.norm(esquinas[2] - esquinas[3])) / 2
+    alto = (np.linalg.norm(esquinas[3] - esquinas[0]) + np.linalg.norm(esquinas[2] - esquinas[1])) / 2
+    _, _, ancho_pt, alto_pt = bloque_layout["rect"]
+    if alto == 0 or alto_pt == 0:
+        return False
+    return abs(math.log((ancho / alto) / (ancho_pt / alto_pt))) <= RAPIDO_TOLERANCIA_FORMA
+
+def calcular_oscuridad_rapida(integral, candidatos, reduccion=CASCADA_REDUCCION):
+    """
+    Vía rápida de la cascada: oscuridad media (255 - intensidad) del cuadro
+    inscrito en cada burbuja, leída con cuatro accesos a la imagen integral de
+    la página reducida (sin CLAHE ni Otsu). Se resta la mediana del bloque
+    para que el tono del papel no cuente. NaN en filas sin burbujas.
+    """
+    filas = len(candidatos)
+    cols = max((len(f) for f in candidatos if f), default=0)
+    oscuridad = np.full((filas, cols), np.nan)
+    if cols == 0:
+        return oscuridad
+
+    cx = np.zeros((filas, cols), dtype=np.int64)
+    cy = np.zeros((filas, cols), dtype=np.int64)
+    k = np.zeros((filas, cols), dtype=np.int64)
+    for i, fila in enumerate(candidatos):
+        for j, c in enumerate(fila or []):
+            cx[i, j], cy[i, j] = c[0][0] // reduccion, c[0][1] // reduccion
+            k[i, j] = max(1, int(0.6 * c[1] / reduccion))
+    presentes = k > 0
+
+    alto, ancho = integral.shape[0] - 1, integral.shape[1] - 1
+    x0, x1 = np.clip(cx - k, 0, ancho - 1), np.clip(cx + k + 1, 1, ancho)
+    y0, y1 = np.clip(cy - k, 0, alto - 1), np.clip(cy + k + 1, 1, alto)
+    suma = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    area = np.maximum((x1 - x0) * (y1 - y0), 1)
+    oscuridad[presentes] = 255.0 - suma[presentes] / area[presentes]
+    return oscuridad - np.median(oscuridad[presentes])
+
+def _revisar_bloque_rapido(integral, bloque_data, bloque_layout, cfg, perfil=None):
+    """
+    Vía rápida de un bloque: burbujas de la plantilla proyectadas sobre el
+    bloque detectado y oscuridad a baja resolución. Devuelve (valores,
+    confianza, filas dudosas) o None si el bloque no coincide con la plantilla.
+    """
+    if not _forma_coincide(bloque_data, bloque_layout):
+        return None
+    inicio = time.perf_counter() if perfil is not None else None
+    candidatos = candidatos_desde_layout(bloque_data, bloque_layout)
+    oscuridad = calcular_oscuridad_rapida(integral, candidatos)
+    valores, _ = _decidir_filas(candidatos, oscuridad, cfg["tipo"])
+    confianza = _confianza_filas(oscuridad, RAPIDO_MARCA)
+    dudosas = [i for i, c in enumerate(confianza)
+               if _fila_dudosa(c) or np.nanmax(oscuridad[i]) < RAPIDO_MARCA_SEGURA]
+    if perfil is not None:
+        registrar_etapa(perfil, "fast", inicio, cfg["tipo"])
+    return valores, confianza, dudosas
+
+def _revisar_bloque_completo(gray, bloque_data, cfg, layout=None, perfil=None, filas=None):
+    """
+    Vía completa de un bloque a resolución completa: burbujas del layout (si
+    se da) o HoughCircles sobre el ROI, y score CLAHE + Otsu. Devuelve
+    (valores, confianza) por fila. filas: con layout solo se puntúan esas
+    filas (las demás quedan en None); Hough siempre recorre el bloque entero.
+    """
+    tipo = cfg["tipo"]
+    x, y, w, h = bloque_data["bbox"]
+    inicio = time.perf_counter() if perfil is not None else None
+
+    if layout is not None:
+        candidatos = candidatos_desde_layout(bloque_data, layout["blocks"][tipo])
+        if filas is not None:
+            candidatos = [c if i in filas else None for i, c in enumerate(candidatos)]
+        bloque_data["scores"] = calcular_scores_bloque(gray, candidatos)
+        valores, _ = _decidir_filas(candidatos, bloque_data["scores"], tipo)
+        if perfil is not None:
+            registrar_etapa(perfil, "scoring", inicio, tipo)
+            registrar_conteo(perfil, tipo, "bubbles", sum(len(f) for f in candidatos if f))
+        return valores, _confianza_filas(bloque_data["scores"], UMBRAL_MARCA)
+
+    roi_gray = gray[y:y+h, x:x+w]
+    roi_gray_blurred = cv2.GaussianBlur(roi_gray, (3, 3), 0)
+
+    circles_hough = cv2.HoughCircles(roi_gray_blurred, cv2.HOUGH_GRADIENT, **cfg["hough_params"])
+    if perfil is not None:
+        inicio = registrar_etapa(perfil, "hough", inicio, tipo)
+        registrar_conteo(perfil, tipo, "hough_candidates", 0 if circles_hough is None else circles_hough.shape[1])
+
+    detected_circles = []
+    if circles_hough is not None:
+        circles_hough = np.uint16(np.around(circles_hough[0, :]))
+        for (cx_r, cy_r, r) in circles_hough:
+            detected_circles.append(((x + cx_r, y + cy_r), int(r)))
+
+    radio_prom = np.mean([r for _, r in detected_circles]) if detected_circles else 10
+    circulos_unicos = filtrar_circulos_superpuestos(detected_circles, min_dist_threshold=radio_prom * 1.5)
+
+    bloque_data["circulos"] = circulos_unicos
+    if perfil is not None:
+        inicio = registrar_etapa(perfil, "merge", inicio, tipo)
+        registrar_conteo(perfil, tipo, "circles", len(circulos_unicos))
+
+    if not circulos_unicos:
+        return [None] * cfg["filas"], [None] * cfg["filas"]
+
+    valores, _ = procesar_bloque(gray, bloque_data, cfg)
+    if perfil is not None:
+        registrar_etapa(perfil, "scoring", inicio, tipo)
+    if "scores" not in bloque_data:
+        return valores, [None] * len(valores)
+    return valores, _confianza_filas(bloque_data["scores"], UMBRAL_MARCA)
+
+def procesar_examen_completo(image_path, num_questions=20, layout=None, piramide=False, perfil=None, cascada=False,
+                             confianza=None):
+    """
+    Envoltura por ruta de archivo de procesar_examen_desde_array.
+    """
+    inicio = time.perf_counter() if perfil is not None else None
     image = cv2.imread(image_path)
     if image is None:
         raise ValueError("No se pudo leer la imagen.")
+    if perfil is not None:
+        registrar_etapa(perfil, "decode", inicio)
+    return procesar_examen_desde_array(image, num_questions, layout=layout, piramide=piramide, perfil=perfil,
+                                       cascada=cascada, confianza=confianza)
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (5,5), 0)
-    thresh = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 19, 3)
+def _a_escala_de_grises(imagen, orden_canales="BGR"):
+    if imagen.ndim == 2:
+        return imagen
+    if imagen.shape[2] == 4:
+        codigo = cv2.COLOR_RGBA2GRAY if orden_canales == "RGB" else cv2.COLOR_BGRA2GRAY
+    else:
+        codigo = cv2.COLOR_RGB2GRAY if orden_canales == "RGB" else cv2.COLOR_BGR2GRAY
+    return cv2.cvtColor(imagen, codigo)
 
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    rectangle_contours = [c for c in contours if len(cv2.approxPolyDP(c, 0.02 * cv2.arcLength(c, True), True)) == 4 and cv2.contourArea(c) > MIN_RECT_AREA]
+def procesar_examen_desde_array(imagen, num_questions=20, orden_canales="BGR", layout=None, piramide=False, perfil=None,
+                                cascada=False, confianza=None):
+    """
+    Función maestra que ejecuta toda la lógica de visión y devuelve
+    los datos estructurados.
 
-    if len(rectangle_contours) < 3:
-        # Fallback o error si no se encuentran los 3 bloques
-        # Si falla, devolvemos estructuras vacías
-        return [], [], []
+    imagen: ndarray en escala de grises (H, W) o a color (H, W, 3|4).
+    orden_canales: "BGR" (cv2.imread) o "RGB" (PIL / rasterizadores de PDF).
+    layout: layout de generate_answer_sheet.py (ver cargar_layout). Si se da,
+    las burbujas se muestrean en las posiciones del layout dentro de cada
+    bloque detectado, sin HoughCircles, y num_questions sale del layout.
+    piramide: localizar los bloques a 1/PIRAMIDE_REDUCCION de escala (ver
+    detectar_bloques_piramide) en lugar de umbralizar la página completa.
+    perfil: dict opcional de perfil_revision.nuevo_perfil; se le suman los ms
+    de cada etapa y los círculos encontrados en cada bloque.
+    cascada: decodificar primero con la vía rápida (rejilla fija del layout o
+    de la hoja estándar, a 1/CASCADA_REDUCCION de escala) y pasar por la vía
+    completa solo las filas dudosas. Implica la búsqueda de bloques en pirámide.
+    confianza: dict opcional; recibe por bloque la lista de confianza de cada
+    fila (ver _confianza_filas), con "tier" "fast" o "full" en la cascada.
+    """
+    if imagen is None or imagen.size == 0:
+        raise ValueError("No se pudo leer la imagen.")
+    if layout is not None:
+        num_questions = layout["num_preguntas"]
 
-    bloques_asignados = asignar_bloques_espacial(rectangle_contours)
+    inicio = time.perf_counter() if perfil is not None else None
+    gray = _a_escala_de_grises(imagen, orden_canales)
+    if perfil is not None:
+        inicio = registrar_etapa(perfil, "grayscale", inicio)
+
+    # Con marcas de registro la hoja se endereza y los bloques salen del layout
+    canonica = registrar_hoja(gray, layout) if layout is not None else None
+    if perfil is not None and layout is not None:
+        registrar_etapa(perfil, "register", inicio)
+    if canonica is not None:
+        gray = canonica
+        bloques_asignados = bloques_desde_layout(layout)
+    else:
+        bloques_asignados = (detectar_bloques_piramide(gray, perfil=perfil) if piramide or cascada
+                             else detectar_bloques(gray, perfil))
+        if bloques_asignados is None:
+            # Fallback o error si no se encuentran los 3 bloques
+            # Si falla, devolvemos estructuras vacías
+            return [], [], []
     
     # Configuración dinámica
     tipo_configs = {
@@ -224,33 +733,40 @@ def procesar_examen_completo(image_path, num_questions=20):
     }
 
     resultados_finales = {}
+    plantilla = (layout or plantilla_por_defecto(num_questions)) if cascada else None
+    integral = None
 
     for tipo, cfg in tipo_configs.items():
         bloque_data = bloques_asignados[tipo]
-        x, y, w, h = bloque_data["bbox"]
-        
-        roi_gray = gray[y:y+h, x:x+w]
-        roi_gray_blurred = cv2.GaussianBlur(roi_gray, (3, 3), 0)
-
-        circles_hough = cv2.HoughCircles(roi_gray_blurred, cv2.HOUGH_GRADIENT, **cfg["hough_params"])
-        
-        detected_circles = []
-        if circles_hough is not None:
-            circles_hough = np.uint16(np.around(circles_hough[0, :]))
-            for (cx_r, cy_r, r) in circles_hough:
-                detected_circles.append(((x + cx_r, y + cy_r), int(r)))
-
-        radio_prom = np.mean([r for _, r in detected_circles]) if detected_circles else 10
-        circulos_unicos = filtrar_circulos_superpuestos(detected_circles, min_dist_threshold=radio_prom * 1.5)
-        
-        bloque_data["circulos"] = circulos_unicos
-        
-        if not circulos_unicos:
-            resultados_finales[tipo] = [None] * cfg["filas"]
-            continue
+        rapido = None
+        if plantilla is not None:
+            if integral is None:
+                inicio = time.perf_counter() if perfil is not None else None
+                h, w = gray.shape
+                integral = cv2.integral(cv2.resize(gray, (w // CASCADA_REDUCCION, h // CASCADA_REDUCCION),
+                                                   interpolation=cv2.INTER_AREA))
+                if perfil is not None:
+                    registrar_etapa(perfil, "fast", inicio)
+            rapido = _revisar_bloque_rapido(integral, bloque_data, plantilla["blocks"][tipo], cfg, perfil)
 
-        vals, _ = procesar_bloque(gray, bloque_data, cfg)
-        resultados_finales[tipo] = vals
+        if rapido is None:
+            valores, confianza_bloque = _revisar_bloque_completo(gray, bloque_data, cfg, layout, perfil)
+            if cascada:
+                confianza_bloque = [dict(c, tier="full") if c else None for c in confianza_bloque]
+        else:
+            valores, confianza_bloque, dudosas = rapido
+            confianza_bloque = [dict(c, tier="fast") if c else None for c in confianza_bloque]
+            if perfil is not None:
+                registrar_conteo(perfil, tipo, "rerun_rows", len(dudosas))
+            if dudosas:
+                valores_c, confianza_c = _revisar_bloque_completo(gray, bloque_data, cfg, layout, perfil, filas=dudosas)
+                for i in dudosas:
+                    if i < len(valores_c):
+                        valores[i] = valores_c[i]
+                        confianza_bloque[i] = dict(confianza_c[i], tier="full") if confianza_c[i] else None
+        resultados_finales[tipo] = valores
+        if confianza is not None:
+            confianza[tipo] = confianza_bloque
 
     # Formatear salida como la app espera
     # Respuestas: [{"question_number": 1, "answer": "A"}, ...]
@@ -272,110 +788,872 @@ def procesar_examen_completo(image_path, num_questions=20):
 #            MAIN APP LOGIC
 # ==========================================
 
-def main():
-    # Verificación de argumentos
-    if len(sys.argv) != 2:
-        print(json.dumps({"error": "Uso: python3 review_answer_sheet.py <imagen_o_pdf>"}))
-        return
+NUM_PREGUNTAS = 20
+DETECTED_EXAMS_DIR = os.path.join(os.path.dirname(__file__), "detected_exams")
+# Versión de la lógica de visión; cambiarla invalida la caché de resultados
+VERSION_REVISION = 2
 
-    input_path = sys.argv[1]
-    NUM_PREGUNTAS = 20
 
-    # Detectar si es PDF y convertir a imagen(s)
-    ext = os.path.splitext(input_path)[1].lower()
-    results_output = []
-    detected_exams_dir = os.path.join(os.path.dirname(__file__), "detected_exams")
-    os.makedirs(detected_exams_dir, exist_ok=True)
+class ErrorDocumento(Exception):
+    """Fallo a nivel documento (p. ej. el PDF no se pudo convertir)."""
 
-    if ext == ".pdf":
-        try:
-            poppler_path = os.environ.get("POPPLER_PATH")
-            if poppler_path:
-                images = convert_from_path(input_path, poppler_path=poppler_path)
-            else:
-                images = convert_from_path(input_path)
-            if not images:
-                print(json.dumps({"error": "No se pudo convertir el PDF a imagen.", "pdfFile": os.path.basename(input_path)}))
-                return
 
-            # Procesar cada página como examen independiente
-            for page_idx, pil_img in enumerate(images, start=1):
-                temp_img_path = os.path.join(os.path.dirname(__file__), f"__temp_review_img__page_{page_idx}.png")
+def _kwargs_poppler():
+    poppler_path = os.environ.get("POPPLER_PATH")
+    return {"poppler_path": poppler_path} if poppler_path else {}
+
+
+def contar_paginas_pdf(input_path):
+    if fitz is not None:
+        with fitz.open(input_path) as doc:
+            return doc.page_count
+    return int(pdfinfo_from_path(input_path, **_kwargs_poppler())["Pages"])
+
+
+def iterar_paginas_pdf(input_path, paginas=None, dpi=PDF_DPI):
+    """
+    Genera (num_pagina, ndarray RGB) rasterizando una página a la vez, de modo
+    que la memoria no crece con el número de páginas. Con PyMuPDF el arreglo
+    apunta directo al buffer del pixmap (sin copia) y solo es válido hasta
+    pedir la siguiente página o cerrar el generador. Sin PyMuPDF se usa pdf2image página por página.
+
+    paginas: índices 1-based a rasterizar (default: todas).
+    Si una página no se puede rasterizar se genera (num_pagina, None).
+    """
+    if fitz is not None:
+        doc = fitz.open(input_path)
+        try:
+            matriz = fitz.Matrix(dpi / 72, dpi / 72)
+            for page_idx in paginas or range(1, doc.page_count + 1):
                 try:
-                    pil_img.save(temp_img_path, "PNG")
-
-                    matricula_circulos, grupo_circulos, detected_answers = procesar_examen_completo(temp_img_path, NUM_PREGUNTAS)
-
-                    nombre = "No detectado"
-                    base_name = os.path.splitext(os.path.basename(input_path))[0]
-                    file_name = f"{base_name}_page_{page_idx}"
-
-                    result = {
-                        "nombre": nombre,
-                        "matricula": ''.join(str(d) if d is not None else '-' for d in matricula_circulos) if matricula_circulos else '',
-                        "grupo": ''.join(str(d) if d is not None else '-' for d in grupo_circulos) if grupo_circulos else '',
-                        "preguntas_detectadas": detected_answers,
-                        "matricula_circulos": matricula_circulos,
-                        "grupo_circulos": grupo_circulos,
-                        "imagen_procesada": temp_img_path,
-                        "pdfFile": os.path.basename(input_path),
-                        "page": page_idx
-                    }
-
-                    output_path = os.path.join(detected_exams_dir, f"reviewed_{file_name}.json")
-                    try:
-                        with open(output_path, "w", encoding="utf-8") as f:
-                            json.dump(result, f, indent=4, ensure_ascii=False)
-                    except Exception as save_err:
-                        sys.stderr.write(f"[ERROR] No se pudo guardar el archivo: {save_err}\n")
-
-                    results_output.append(result)
-                except Exception as page_err:
-                    results_output.append({"error": str(page_err), "pdfFile": os.path.basename(input_path), "page": page_idx})
-                finally:
-                    if os.path.exists(temp_img_path):
-                        try:
-                            os.remove(temp_img_path)
-                        except Exception:
-                            pass
-
-            # Imprimir array de resultados para que el backend pueda parsearlo (solo stdout)
-            sys.stdout.write(json.dumps(results_output) + "\n")
-            sys.stdout.flush()
-            return
+                    pix = doc.load_page(page_idx - 1).get_pixmap(matrix=matriz, colorspace=fitz.csRGB, alpha=False)
+                    imagen = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+                except Exception as e:
+                    sys.stderr.write(f"[ERROR] No se pudo rasterizar la página {page_idx}: {e}\n")
+                    imagen = None
+                yield page_idx, imagen
+                pix = imagen = None
+                # Vaciar la caché de MuPDF para que la memoria no crezca por página
+                fitz.TOOLS.store_shrink(100)
+        finally:
+            doc.close()
+        return
+
+    kwargs = _kwargs_poppler()
+    for page_idx in paginas or range(1, contar_paginas_pdf(input_path) + 1):
+        try:
+            imagenes = convert_from_path(input_path, dpi=dpi, first_page=page_idx, last_page=page_idx, **kwargs)
+            imagen = np.asarray(imagenes[0]) if imagenes else None
         except Exception as e:
-            sys.stdout.write(json.dumps({"error": f"Error al convertir PDF: {str(e)}", "pdfFile": os.path.basename(input_path)}) + "\n")
-            sys.stdout.flush()
-            return
+            sys.stderr.write(f"[ERROR] No se pudo rasterizar la página {page_idx}: {e}\n")
+            imagen = None
+        yield page_idx, imagen
+        imagenes = imagen = None
 
-    else:
-        image_path = input_path
 
-    # Si no es PDF, procesar la única imagen y devolver como array con un solo elemento
+def _guardar_resultado(result, file_name):
+    output_path = os.path.join(DETECTED_EXAMS_DIR, f"reviewed_{file_name}.json")
+    try:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4, ensure_ascii=False)
+    except Exception as save_err:
+        sys.stderr.write(f"[ERROR] No se pudo guardar el archivo: {save_err}\n")
+
+
+def _formatear_digitos(circulos):
+    return ''.join(str(d) if d is not None else '-' for d in circulos) if circulos else ''
+
+
+def configuracion_revision(num_preguntas=NUM_PREGUNTAS, layout=None, piramide=False, cascada=False):
+    """Todo lo que cambia el resultado de una página además de sus píxeles (parte de la clave de caché)."""
+    return {
+        "version": VERSION_REVISION,
+        "dpi": PDF_DPI,
+        "num_preguntas": layout["num_preguntas"] if layout is not None else num_preguntas,
+        "layout": hashlib.sha256(json.dumps(layout, sort_keys=True).encode("utf-8")).hexdigest() if layout is not None else None,
+        "piramide": piramide,
+        "cascada": cascada
+    }
+
+
+def abrir_cache():
+    """Abre la caché de resultados; si no se puede (p. ej. disco de solo lectura) se revisa sin caché."""
+    try:
+        return CacheResultados()
+    except Exception as e:
+        sys.stderr.write(f"[WARN] Caché de resultados desactivada: {e}\n")
+        return None
+
+
+def _resultado_desde_cache(guardado, input_path, page_idx, file_name, guardar_json=True):
+    """Resultado guardado con las rutas del archivo actual (el mismo contenido puede tener otro nombre)."""
+    result = dict(guardado, imagen_procesada=input_path)
+    if page_idx is not None:
+        result["pdfFile"] = os.path.basename(input_path)
+        result["page"] = page_idx
+    # Solo se escribe el JSON si falta; sin cambios no hay nada que reescribir
+    if guardar_json and not os.path.exists(os.path.join(DETECTED_EXAMS_DIR, f"reviewed_{file_name}.json")):
+        _guardar_resultado(result, file_name)
+    return result
+
+
+def _para_cache(result):
+    """El perfil describe una corrida, no la página: no se guarda en la caché."""
+    return {k: v for k, v in result.items() if k != "profile"} if "profile" in result else result
+
+
+def _paginas_con_perfil(paginas):
+    """
+    Envuelve iterar_paginas_pdf y genera (num_pagina, imagen, perfil); con
+    PERFILAR el perfil ya trae el tiempo de rasterizado, si no es None.
+    """
+    try:
+        while True:
+            inicio = time.perf_counter() if PERFILAR else None
+            try:
+                page_idx, imagen = next(paginas)
+            except StopIteration:
+                return
+            perfil = None
+            if inicio is not None:
+                perfil = nuevo_perfil()
+                registrar_etapa(perfil, "rasterize", inicio)
+            yield page_idx, imagen, perfil
+    finally:
+        paginas.close()
+
+
+def revisar_pagina_pdf(input_path, page_idx, imagen, num_preguntas=NUM_PREGUNTAS, layout=None, piramide=False,
+                       guardar_json=True, perfil=None, cascada=False):
+    """
+    Revisa una página ya rasterizada (RGB) de un PDF y guarda su JSON (si
+    guardar_json; con --store los resultados van al almacén del lote).
+    Cualquier error queda aislado en el resultado de esa página.
+
+    perfil: ver procesar_examen_desde_array; si se da, el resultado lleva su
+    resumen en "profile".
+    """
     try:
-        matricula_circulos, grupo_circulos, detected_answers = procesar_examen_completo(image_path, NUM_PREGUNTAS)
+        # La página pasa directo del rasterizador a la visión, sin PNG temporal
+        confianza = {}
+        matricula_circulos, grupo_circulos, detected_answers = procesar_examen_desde_array(
+            imagen, num_preguntas, orden_canales="RGB", layout=layout, piramide=piramide, perfil=perfil,
+            cascada=cascada, confianza=confianza)
+
         nombre = "No detectado"
-        folder_name = os.path.basename(os.path.dirname(image_path))
-        file_name = os.path.basename(image_path).replace(".png", "").replace(".jpg", "").replace(".jpeg", "")
+        file_name = nombre_pagina(input_path, page_idx)
+
         result = {
             "nombre": nombre,
-            "matricula": ''.join(str(d) if d is not None else '-' for d in matricula_circulos),
-            "grupo": ''.join(str(d) if d is not None else '-' for d in grupo_circulos),
+            "matricula": _formatear_digitos(matricula_circulos),
+            "grupo": _formatear_digitos(grupo_circulos),
             "preguntas_detectadas": detected_answers,
             "matricula_circulos": matricula_circulos,
             "grupo_circulos": grupo_circulos,
-            "imagen_procesada": image_path
+            "confidence": confianza,
+            "imagen_procesada": input_path,
+            "pdfFile": os.path.basename(input_path),
+            "page": page_idx
         }
-        output_path = os.path.join(detected_exams_dir, f"reviewed_{folder_name}_{file_name}.json")
+        if perfil is not None:
+            result["profile"] = cerrar_perfil(perfil)
+        if guardar_json:
+            _guardar_resultado(result, file_name)
+        return result
+    except Exception as page_err:
+        return {"error": str(page_err), "pdfFile": os.path.basename(input_path), "page": page_idx}
+
+
+def _revisar_pagina_en_worker(tarea):
+    """Rasteriza y revisa una sola página dentro de un proceso del pool."""
+    input_path, page_idx, opciones = tarea
+    paginas = _paginas_con_perfil(iterar_paginas_pdf(input_path, paginas=[page_idx]))
+    try:
+        try:
+            _, imagen, perfil = next(paginas)
+        except Exception as e:
+            return {"error": f"Error al convertir PDF: {str(e)}", "pdfFile": os.path.basename(input_path), "page": page_idx}
+        # El generador sigue abierto mientras se usa la imagen (vista sin copia del pixmap)
+        return revisar_pagina_pdf(input_path, page_idx, imagen, perfil=perfil, **opciones)
+    finally:
+        paginas.close()
+
+
+def iterar_resultados(input_path, num_preguntas=NUM_PREGUNTAS, pool=None, layout=None, piramide=False, cache=None,
+                      guardar_json=True, cascada=False):
+    """
+    Revisa un PDF (una hoja por página) o una imagen y genera los resultados
+    página por página, en orden. Los errores de página se generan como
+    resultados; si el documento completo no se puede leer se lanza
+    ErrorDocumento antes del primer resultado.
+
+    pool: multiprocessing.Pool opcional; si se da, las páginas de un PDF se
+    reparten entre sus procesos (cada uno rasteriza su propia página) y los
+    resultados se siguen generando en orden de página.
+
+    layout, piramide, cascada: ver procesar_examen_desde_array.
+
+    cache: CacheResultados opcional. Las páginas cuyo contenido y
+    configuración ya se revisaron salen de la caché sin rasterizarse; solo
+    se guardan los resultados sin error.
+
+    guardar_json: escribir detected_exams/reviewed_*.json por página.
+    """
+    ext = os.path.splitext(input_path)[1].lower()
+    os.makedirs(DETECTED_EXAMS_DIR, exist_ok=True)
+    configuracion = configuracion_revision(num_preguntas, layout, piramide, cascada) if cache is not None else None
+
+    if ext == ".pdf":
+        try:
+            total_paginas = contar_paginas_pdf(input_path)
+        except Exception as e:
+            raise ErrorDocumento(f"Error al convertir PDF: {str(e)}")
+        if total_paginas == 0:
+            raise ErrorDocumento("No se pudo convertir el PDF a imagen.")
+
+        claves, guardados = {}, {}
+        if cache is not None:
+            hash_documento = cache.hash_documento(input_path)
+            claves = {p: clave_pagina(hash_documento, p, configuracion) for p in range(1, total_paginas + 1)}
+            guardados = cache.obtener_varios(claves.values())
+        faltantes = [p for p in range(1, total_paginas + 1) if claves.get(p) not in guardados]
+
+        if not faltantes:
+            calculados = iter(())
+        elif pool is not None:
+            opciones = {"num_preguntas": num_preguntas, "layout": layout, "piramide": piramide, "guardar_json": guardar_json,
+                        "cascada": cascada}
+            calculados = pool.imap(_revisar_pagina_en_worker, [(input_path, p, opciones) for p in faltantes])
+        else:
+            # Procesar cada página como examen independiente
+            calculados = (revisar_pagina_pdf(input_path, page_idx, imagen, num_preguntas, layout, piramide, guardar_json, perfil,
+                                             cascada)
+                          for page_idx, imagen, perfil in _paginas_con_perfil(iterar_paginas_pdf(input_path, paginas=faltantes)))
+
+        for page_idx in range(1, total_paginas + 1):
+            clave = claves.get(page_idx)
+            if clave in guardados:
+                yield _resultado_desde_cache(guardados[clave], input_path, page_idx, nombre_pagina(input_path, page_idx),
+                                             guardar_json)
+                continue
+            result = next(calculados)
+            if cache is not None and "error" not in result:
+                cache.guardar(clave, _para_cache(result))
+            yield result
+        return
+
+    # Si no es PDF, procesar la única imagen
+    image_path = input_path
+    file_name = nombre_imagen(image_path)
+    clave = None
+    if cache is not None:
+        try:
+            clave = clave_pagina(cache.hash_documento(image_path), None, configuracion)
+        except OSError as e:
+            raise ErrorDocumento(str(e))
+        guardado = cache.obtener(clave)
+        if guardado is not None:
+            yield _resultado_desde_cache(guardado, image_path, None, file_name, guardar_json)
+            return
+    perfil = nuevo_perfil() if PERFILAR else None
+    confianza = {}
+    try:
+        matricula_circulos, grupo_circulos, detected_answers = procesar_examen_completo(image_path, num_preguntas, layout,
+                                                                                        piramide, perfil, cascada, confianza)
+    except Exception as e:
+        raise ErrorDocumento(str(e))
+    nombre = "No detectado"
+    result = {
+        "nombre": nombre,
+        "matricula": ''.join(str(d) if d is not None else '-' for d in matricula_circulos),
+        "grupo": ''.join(str(d) if d is not None else '-' for d in grupo_circulos),
+        "preguntas_detectadas": detected_answers,
+        "matricula_circulos": matricula_circulos,
+        "grupo_circulos": grupo_circulos,
+        "confidence": confianza,
+        "imagen_procesada": image_path
+    }
+    if perfil is not None:
+        result["profile"] = cerrar_perfil(perfil)
+    if guardar_json:
+        _guardar_resultado(result, file_name)
+    if clave is not None:
+        cache.guardar(clave, _para_cache(result))
+    yield result
+
+
+def revisar_archivo(input_path, num_preguntas=NUM_PREGUNTAS, pool=None, layout=None, piramide=False, cache=None,
+                    guardar_json=True, cascada=False):
+    """Igual que iterar_resultados pero devuelve la lista completa."""
+    return list(iterar_resultados(input_path, num_preguntas, pool, layout, piramide, cache, guardar_json, cascada))
+
+
+def _escribir_jsonl(registro):
+    sys.stdout.write(json.dumps(registro) + "\n")
+    sys.stdout.flush()
+
+
+def emitir_jsonl(input_path, num_preguntas=NUM_PREGUNTAS, pool=None, layout=None, piramide=False, cache=None,
+                 almacen=None, cascada=False):
+    """
+    Modo --jsonl: escribe cada resultado en cuanto su página termina y cierra
+    con un registro resumen {"summary": true, "pages_ok", "pages_failed", ...}.
+
+    almacen: AlmacenResultados opcional; recibe cada resultado en lugar de
+    los reviewed_*.json por página.
+    """
+    inicio = time.perf_counter()
+    pages_ok = pages_failed = 0
+    perfiles = AcumuladorPerfil() if PERFILAR else None
+    try:
+        for result in iterar_resultados(input_path, num_preguntas, pool, layout, piramide, cache,
+                                        guardar_json=almacen is None, cascada=cascada):
+            if almacen is not None:
+                almacen.agregar(result)
+            if perfiles is not None:
+                perfiles.agregar(result)
+            if "error" in result:
+                pages_failed += 1
+            else:
+                pages_ok += 1
+            _escribir_jsonl(result)
+    except ErrorDocumento as e:
+        _escribir_jsonl({"error": str(e), "pdfFile": os.path.basename(input_path)})
+    resumen = {
+        "summary": True,
+        "pdfFile": os.path.basename(input_path),
+        "pages_ok": pages_ok,
+        "pages_failed": pages_failed,
+        "elapsed_s": round(time.perf_counter() - inicio, 3)
+    }
+    if perfiles is not None:
+        resumen["profile"] = perfiles.reporte()
+    _escribir_jsonl(resumen)
+
+# ==========================================
+#        MODO LOTE (muchos documentos)
+# ==========================================
+
+EXTENSIONES_REVISABLES = (".pdf", ".png", ".jpg", ".jpeg")
+
+
+def _es_revisable(ruta):
+    return os.path.isfile(ruta) and os.path.splitext(ruta)[1].lower() in EXTENSIONES_REVISABLES
+
+
+def _es_entrada_de_lote(entrada):
+    """
+    Una sola entrada va al lote solo si es carpeta, patrón glob o manifiesto
+    .txt. Un archivo suelto (aunque no exista o no sea revisable) sigue por el
+    modo de un archivo, cuya salida de error es la que parsea /process-all.
+    """
+    return os.path.isdir(entrada) or any(c in entrada for c in "*?[") or entrada.lower().endswith(".txt")
+
+
+def expandir_entradas(entradas):
+    """
+    Convierte las entradas de la línea de comandos en la lista de archivos a
+    revisar: un directorio aporta sus PDFs/imágenes, un patrón glob sus
+    coincidencias y un manifiesto .txt una ruta por línea (relativa al
+    manifiesto; se ignoran líneas vacías y las que empiezan con #).
+    """
+    rutas = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            rutas.extend(r for r in (os.path.join(entrada, f) for f in sorted(os.listdir(entrada))) if _es_revisable(r))
+        elif any(c in entrada for c in "*?["):
+            rutas.extend(r for r in sorted(glob.glob(entrada)) if _es_revisable(r))
+        elif entrada.lower().endswith(".txt"):
+            base = os.path.dirname(os.path.abspath(entrada))
+            with open(entrada, encoding="utf-8") as f:
+                for linea in f:
+                    linea = linea.strip()
+                    if linea and not linea.startswith("#"):
+                        rutas.append(os.path.join(base, linea))
+        else:
+            rutas.append(entrada)
+
+    vistas = set()
+    unicas = []
+    for ruta in rutas:
+        clave = os.path.abspath(ruta)
+        if clave not in vistas:
+            vistas.add(clave)
+            unicas.append(ruta)
+    return unicas
+
+
+def _revisar_tarea_lote(tarea):
+    """Tarea de la cola global: una página de PDF o una imagen completa."""
+    input_path, page_idx, opciones = tarea
+    inicio = time.perf_counter()
+    if page_idx is not None:
+        result = _revisar_pagina_en_worker(tarea)
+    else:
         try:
-            with open(output_path, "w", encoding="utf-8") as f:
-                json.dump(result, f, indent=4, ensure_ascii=False)
-        except Exception as save_err:
-            sys.stderr.write(f"[ERROR] No se pudo guardar el archivo: {save_err}\n")
-        #print(json.dumps([result]))
+            result = revisar_archivo(input_path, **opciones)[0]
+        except ErrorDocumento as e:
+            result = {"error": str(e), "pdfFile": os.path.basename(input_path)}
+    return input_path, page_idx, result, time.perf_counter() - inicio
+
+
+def revisar_lote(rutas, num_preguntas=NUM_PREGUNTAS, pool=None, layout=None, piramide=False, cache=None, paginas=None,
+                 guardar_json=True, cascada=False):
+    """
+    Revisa varios documentos con una sola cola global de páginas. Los
+    documentos más largos se encolan primero para que no sean los que dejan
+    trabajando a un solo núcleo al final del lote.
+
+    Genera registros en orden de finalización:
+    - el resultado de cada página (mismo formato que iterar_resultados),
+    - {"summary": true, "pdfFile", ...} cuando termina cada documento,
+    - {"summary": true, "aggregate": true, ...} al final del lote.
+
+    cache: CacheResultados opcional; las páginas ya revisadas se generan de
+    inmediato sin encolarse (ver iterar_resultados).
+
+    paginas: {ruta: [páginas 1-based]} opcional para revisar solo esas páginas
+    de un PDF (None o ruta ausente: todas). Los totales del resumen de cada
+    documento cuentan solo las páginas revisadas.
+
+    guardar_json: ver iterar_resultados.
+    """
+    paginas = paginas or {}
+    inicio = time.perf_counter()
+    documentos = {}
+    tareas = []
+    for ruta in rutas:
+        doc = {"pdfFile": os.path.basename(ruta), "pages": 1, "pages_ok": 0, "pages_failed": 0, "busy_s": 0.0,
+               "reviewed": 0, "reviewed_s": 0.0}
+        if os.path.splitext(ruta)[1].lower() == ".pdf":
+            try:
+                doc["pages"] = contar_paginas_pdf(ruta)
+                if doc["pages"] == 0:
+                    raise ErrorDocumento("No se pudo convertir el PDF a imagen.")
+            except Exception as e:
+                yield {"error": f"Error al convertir PDF: {str(e)}" if not isinstance(e, ErrorDocumento) else str(e),
+                       "pdfFile": doc["pdfFile"]}
+                continue
+            doc["indices"] = [p for p in paginas.get(ruta) or range(1, doc["pages"] + 1) if p <= doc["pages"]]
+            doc["pages"] = len(doc["indices"])
+        else:
+            doc["indices"] = [None]
+        if doc["pages"] > 0:
+            documentos[ruta] = doc
+
+    os.makedirs(DETECTED_EXAMS_DIR, exist_ok=True)
+    opciones = {"num_preguntas": num_preguntas, "layout": layout, "piramide": piramide, "guardar_json": guardar_json,
+                "cascada": cascada}
+    configuracion = configuracion_revision(num_preguntas, layout, piramide, cascada) if cache is not None else None
+    claves, guardados = {}, {}
+    for ruta in sorted(documentos, key=lambda r: documentos[r]["pages"], reverse=True):
+        indices = documentos[ruta]["indices"]
+        if cache is not None:
+            try:
+                hash_documento = cache.hash_documento(ruta)
+            except OSError:
+                hash_documento = None  # La tarea reportará el error
+            if hash_documento is not None:
+                claves_doc = {(ruta, p): clave_pagina(hash_documento, p, configuracion) for p in indices}
+                claves.update(claves_doc)
+                guardados.update(cache.obtener_varios(claves_doc.values()))
+        tareas.extend((ruta, page_idx, opciones) for page_idx in indices if claves.get((ruta, page_idx)) not in guardados)
+
+    contadores = {"ok": 0, "failed": 0, "reviewed": 0}
+    perfiles = AcumuladorPerfil() if PERFILAR else None
+
+    def completar(ruta, result, segundos, desde_cache=False):
+        doc = documentos[ruta]
+        doc["busy_s"] += segundos
+        if perfiles is not None:
+            perfiles.agregar(result)
+        if "error" in result:
+            doc["pages_failed"] += 1
+            contadores["failed"] += 1
+        else:
+            doc["pages_ok"] += 1
+            contadores["ok"] += 1
+            if not desde_cache:
+                doc["reviewed"] += 1
+                doc["reviewed_s"] += segundos
+                contadores["reviewed"] += 1
+        yield result
+        if doc["pages_ok"] + doc["pages_failed"] == doc["pages"]:
+            yield {
+                "summary": True,
+                "pdfFile": doc["pdfFile"],
+                "pages_ok": doc["pages_ok"],
+                "pages_failed": doc["pages_failed"],
+                "busy_s": round(doc["busy_s"], 3),
+                # Solo páginas revisadas de verdad: ni errores instantáneos ni aciertos de caché
+                "pages_per_s": round(doc["reviewed"] / doc["reviewed_s"], 2) if doc["reviewed_s"] > 0 else None,
+                "finished_at_s": round(time.perf_counter() - inicio, 3)
+            }
+
+    # Aciertos de caché primero: no ocupan al pool
+    for (ruta, page_idx), clave in claves.items():
+        if clave in guardados:
+            file_name = nombre_pagina(ruta, page_idx) if page_idx is not None else nombre_imagen(ruta)
+            yield from completar(ruta, _resultado_desde_cache(guardados[clave], ruta, page_idx, file_name, guardar_json), 0.0,
+                                 desde_cache=True)
+
+    ejecutar = pool.imap_unordered(_revisar_tarea_lote, tareas) if pool is not None else map(_revisar_tarea_lote, tareas)
+    for ruta, page_idx, result, segundos in ejecutar:
+        if cache is not None and "error" not in result and (ruta, page_idx) in claves:
+            cache.guardar(claves[(ruta, page_idx)], _para_cache(result))
+        yield from completar(ruta, result, segundos)
+
+    transcurrido = time.perf_counter() - inicio
+    resumen = {
+        "summary": True,
+        "aggregate": True,
+        "documents": len(documentos),
+        "pages_ok": contadores["ok"],
+        "pages_failed": contadores["failed"],
+        "elapsed_s": round(transcurrido, 3),
+        "pages_per_s": round(contadores["reviewed"] / transcurrido, 2) if contadores["reviewed"] else None
+    }
+    if perfiles is not None:
+        resumen["profile"] = perfiles.reporte()
+    yield resumen
+
+# ==========================================
+#        MODO WORKER (proceso persistente)
+# ==========================================
+
+_cache_worker = None  # Caché propia de cada proceso en modo worker
+
+
+def _inicializar_worker(usar_cache=False):
+    """
+    Calienta OpenCV y el CLAHE una sola vez por proceso del pool. El pool ya
+    reparte el trabajo entre núcleos, así que OpenCV usa un solo hilo por
+    proceso para no sobresuscribir la CPU.
+
+    usar_cache: en modo worker cada proceso abre su conexión a la caché de
+    resultados (en lote la consulta el proceso principal).
+    """
+    global _cache_worker
+    cv2.setNumThreads(1)
+    _clahe_score.apply(np.zeros((16, 16), dtype=np.uint8))
+    if usar_cache:
+        _cache_worker = abrir_cache()
+
+
+def _ejecutar_trabajo(trabajo):
+    """
+    Ejecuta una solicitud {"id", "path", "num_preguntas", "layout", "pyramid",
+    "cascade", "cache"} dentro de un worker; "layout" es la ruta opcional del
+    layout JSON del examen, "pyramid" activa la detección de bloques en
+    pirámide, "cascade" la decodificación en cascada y "cache": false revisa
+    sin consultar la caché de resultados.
+    """
+    input_path = trabajo["path"]
+    respuesta = {"id": trabajo.get("id"), "pdfFile": os.path.basename(input_path)}
+    try:
+        layout = cargar_layout(trabajo["layout"]) if trabajo.get("layout") else None
+        respuesta["results"] = revisar_archivo(input_path, int(trabajo.get("num_preguntas", NUM_PREGUNTAS)),
+                                               layout=layout, piramide=bool(trabajo.get("pyramid")),
+                                               cache=_cache_worker if trabajo.get("cache", True) else None,
+                                               cascada=bool(trabajo.get("cascade")))
+        if PERFILAR:
+            perfiles = AcumuladorPerfil()
+            for result in respuesta["results"]:
+                perfiles.agregar(result)
+            respuesta["profile"] = perfiles.reporte()
     except Exception as e:
-        sys.stdout.write(json.dumps({"error": str(e), "pdfFile": os.path.basename(input_path)}) + "\n")
+        respuesta["error"] = str(e)
+    return respuesta
+
+
+def _atender_trabajos(pool, lineas, escribir):
+    """
+    Lee solicitudes JSON (una por línea) y escribe una respuesta JSON por línea
+    en cuanto cada trabajo termina. El orden de salida es el de finalización;
+    el campo "id" permite al cliente emparejar respuestas.
+    """
+    lock = threading.Lock()
+    pendientes = []
+
+    def responder(respuesta):
+        with lock:
+            escribir(json.dumps(respuesta, ensure_ascii=False) + "\n")
+
+    for linea in lineas:
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            trabajo = json.loads(linea)
+            if not isinstance(trabajo.get("path"), str):
+                raise ValueError("falta 'path'")
+        except (ValueError, AttributeError) as e:
+            responder({"error": f"Solicitud inválida: {e}"})
+            continue
+        pendientes.append(pool.apply_async(
+            _ejecutar_trabajo, (trabajo,), callback=responder,
+            error_callback=lambda e, t=trabajo: responder({"id": t.get("id"), "error": str(e)})))
+
+    for pendiente in pendientes:
+        pendiente.wait()
+
+
+def servir(num_workers=None, socket_path=None, usar_cache=True):
+    """
+    Mantiene un pool de procesos con cv2/numpy ya importados y atiende
+    solicitudes por stdin o, si se indica, por un socket Unix local.
+    """
+    num_workers = num_workers or os.cpu_count() or 1
+    with multiprocessing.Pool(num_workers, initializer=_inicializar_worker, initargs=(usar_cache,)) as pool:
+        if socket_path is None:
+            def escribir(texto):
+                sys.stdout.write(texto)
+                sys.stdout.flush()
+            _atender_trabajos(pool, sys.stdin, escribir)
+            return
+
+        class _Manejador(socketserver.StreamRequestHandler):
+            def handle(self):
+                lineas = (l.decode("utf-8") for l in self.rfile)
+
+                def escribir(texto):
+                    self.wfile.write(texto.encode("utf-8"))
+                    self.wfile.flush()
+                _atender_trabajos(pool, lineas, escribir)
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        with socketserver.ThreadingUnixStreamServer(socket_path, _Manejador) as server:
+            sys.stderr.write(f"[INFO] Escuchando en {socket_path} con {num_workers} workers\n")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os.remove(socket_path)
+
+
+def _contar_paginas_documento(ruta):
+    return contar_paginas_pdf(ruta) if os.path.splitext(ruta)[1].lower() == ".pdf" else 1
+
+
+def _seguir_en_manifiesto(manifiesto, registros):
+    """Registra en el manifiesto cada página y documento en cuanto terminan."""
+    fallidos = set()
+    for registro in registros:
+        nombre = registro.get("pdfFile") or os.path.basename(registro.get("imagen_procesada", ""))
+        if registro.get("aggregate"):
+            pass
+        elif registro.get("summary"):
+            # Una imagen que falla completa también trae resumen: no debe bajar de fallido a error
+            if nombre not in fallidos:
+                manifiesto.marcar_documento(nombre, ESTADO_ERROR if registro["pages_failed"] else ESTADO_COMPLETO)
+        elif "page" in registro or "imagen_procesada" in registro:
+            manifiesto.marcar_pagina(nombre, registro.get("page") or 1, "error" not in registro)
+        else:
+            # Error a nivel documento (p. ej. el PDF o la imagen no abre): no se reintenta hasta que cambie
+            manifiesto.marcar_documento(nombre, ESTADO_FALLIDO)
+            fallidos.add(nombre)
+        yield registro
+
+
+def _guardar_en_almacen(almacen, registros):
+    """Agrega al almacén del lote cada resultado de página (no los resúmenes)."""
+    for registro in registros:
+        if not registro.get("summary"):
+            almacen.agregar(registro)
+        yield registro
+
+
+def revisar_lote_cli(args, cache=None, incremental=None, almacen=None):
+    """
+    incremental: (manifiesto, plan) del modo --incremental; se revisan solo
+    las páginas pendientes del plan y la salida incluye qué se omitió.
+    almacen: AlmacenResultados de --store.
+    """
+    if incremental is None:
+        rutas, paginas = expandir_entradas(args.entradas), None
+    else:
+        manifiesto, plan = incremental
+        paginas = plan.pop("pendientes")
+        rutas = list(paginas)
+    num_workers = args.workers or os.cpu_count() or 1
+    pool = multiprocessing.Pool(num_workers, initializer=_inicializar_worker) if num_workers > 1 and rutas else None
+    try:
+        registros = revisar_lote(rutas, NUM_PREGUNTAS, pool, args.layout, args.pyramid, cache, paginas,
+                                 guardar_json=almacen is None, cascada=args.cascade)
+        if almacen is not None:
+            registros = _guardar_en_almacen(almacen, registros)
+        if incremental is not None:
+            registros = _seguir_en_manifiesto(manifiesto, registros)
+
+        if args.jsonl:
+            for registro in registros:
+                _escribir_jsonl(registro)
+            if incremental is not None:
+                _escribir_jsonl(dict({"summary": True, "incremental": True}, **plan))
+            return
+
+        results_output, documents = [], []
+        for registro in registros:
+            if registro.get("aggregate"):
+                summary = registro
+            elif registro.get("summary"):
+                documents.append(registro)
+            else:
+                results_output.append(registro)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    orden = {os.path.basename(r): i for i, r in enumerate(rutas)}
+    results_output.sort(key=lambda r: (orden.get(r.get("pdfFile") or os.path.basename(r.get("imagen_procesada", "")), len(orden)),
+                                       r.get("page") or 0))
+    salida = {"results": results_output, "documents": documents, "summary": summary}
+    if incremental is not None:
+        salida["incremental"] = plan
+    sys.stdout.write(json.dumps(salida) + "\n")
+    sys.stdout.flush()
+
+
+def revisar_incremental_cli(args, cache=None, almacen=None):
+    """
+    Modo --incremental <dir>: revisa solo los documentos nuevos o cambiados
+    de la carpeta y retoma los que quedaron a medias, según su manifiesto.
+    """
+    directorio = args.incremental
+    if not os.path.isdir(directorio):
+        print(json.dumps({"error": f"No existe la carpeta: {directorio}"}))
+        return
+    manifiesto = ManifiestoIngesta(directorio)
+    try:
+        plan = manifiesto.planificar(expandir_entradas([directorio]), _contar_paginas_documento)
+        revisar_lote_cli(args, cache, incremental=(manifiesto, plan), almacen=almacen)
+    finally:
+        manifiesto.cerrar()
+
+
+def revisar_cli(args, cache=None, almacen=None):
+    """Despacha la revisión según los argumentos: incremental, lote o un solo archivo."""
+    if args.incremental:
+        revisar_incremental_cli(args, cache, almacen)
+        return
+
+    if len(args.entradas) > 1 or _es_entrada_de_lote(args.entradas[0]):
+        revisar_lote_cli(args, cache, almacen=almacen)
+        return
+
+    input_path = args.entradas[0]
+    pool = None
+    if args.workers and args.workers > 1 and os.path.splitext(input_path)[1].lower() == ".pdf":
+        pool = multiprocessing.Pool(args.workers, initializer=_inicializar_worker)
+    try:
+        if args.jsonl:
+            emitir_jsonl(input_path, NUM_PREGUNTAS, pool, args.layout, args.pyramid, cache, almacen, args.cascade)
+            return
+
+        try:
+            results_output = revisar_archivo(input_path, NUM_PREGUNTAS, pool, args.layout, args.pyramid, cache,
+                                             guardar_json=almacen is None, cascada=args.cascade)
+        except ErrorDocumento as e:
+            sys.stdout.write(json.dumps({"error": str(e), "pdfFile": os.path.basename(input_path)}) + "\n")
+            sys.stdout.flush()
+            return
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if almacen is not None:
+        for result in results_output:
+            almacen.agregar(result)
+
+    if PERFILAR:
+        # stdout lo parsea el backend tal cual; el resumen de la corrida va a stderr
+        perfiles = AcumuladorPerfil()
+        for result in results_output:
+            perfiles.agregar(result)
+        sys.stderr.write(f"[PROFILE] {json.dumps(perfiles.reporte())}\n")
+
+    if os.path.splitext(input_path)[1].lower() == ".pdf":
+        # Imprimir array de resultados para que el backend pueda parsearlo (solo stdout)
+        sys.stdout.write(json.dumps(results_output) + "\n")
         sys.stdout.flush()
 
+def main():
+    parser = argparse.ArgumentParser(description="Revisa hojas de respuestas (PDF o imagen)")
+    parser.add_argument("entradas", nargs="*",
+                        help="PDF o imagen a revisar; también directorios, patrones glob o "
+                             "manifiestos .txt (una ruta por línea) para revisar en lote")
+    parser.add_argument("--serve", action="store_true",
+                        help="Modo worker: lee solicitudes JSON por línea desde stdin (o --socket)")
+    parser.add_argument("--socket", default=None,
+                        help="Ruta de socket Unix para el modo worker en lugar de stdin")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Procesos del pool: en modo worker y en lote (default: núm. de CPUs) o "
+                             "para repartir las páginas de un PDF (default: 1, secuencial)")
+    parser.add_argument("--jsonl", action="store_true",
+                        help="Escribir un JSON por página en cuanto termina, más un resumen final")
+    parser.add_argument("--layout", default=None,
+                        help="Layout JSON del examen (generate_answer_sheet.py): muestrea las burbujas "
+                             "en posiciones fijas en lugar de buscarlas con HoughCircles")
+    parser.add_argument("--pyramid", action="store_true",
+                        help="Buscar los 3 bloques en una copia a 1/4 de escala y refinar su borde "
+                             "a resolución completa (más rápido que umbralizar toda la página)")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Decodificar primero con una rejilla fija a baja resolución (layout o hoja "
+                             "estándar) y pasar por HoughCircles + CLAHE solo las filas dudosas; implica --pyramid")
+    parser.add_argument("--incremental", metavar="DIR", default=None,
+                        help="Revisar solo los PDFs/imágenes nuevos o cambiados de DIR desde la corrida "
+                             "anterior (manifiesto DIR/.manifiesto_revision.sqlite) y retomar los que "
+                             "quedaron a medias")
+    parser.add_argument("--store", metavar="LOTE", default=None,
+                        help="Agregar los resultados al almacén LOTE.jsonl (con índice LOTE.jsonl.idx) en "
+                             "lugar de escribir un reviewed_*.json por página; sin carpeta, va a detected_exams/")
+    parser.add_argument("--profile", action="store_true",
+                        help="Agregar a cada resultado los ms de cada etapa (rasterizado, umbral, contornos, "
+                             "Hough, scoring...) y los círculos por bloque, más un resumen de la corrida "
+                             "(equivale a REVIEW_PROFILE=1)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="No consultar ni guardar la caché de resultados (cache/revisiones.sqlite "
+                             "o REVIEW_CACHE_PATH); por defecto las páginas sin cambios no se revisan de nuevo")
+    args = parser.parse_args()
+
+    if args.profile:
+        global PERFILAR
+        PERFILAR = True
+        # Los procesos del pool leen el mismo ajuste al importar el módulo
+        os.environ["REVIEW_PROFILE"] = "1"
+
+    if args.serve:
+        servir(args.workers, args.socket, usar_cache=not args.no_cache)
+        return
+
+    # Verificación de argumentos
+    if not args.entradas and not args.incremental:
+        print(json.dumps({"error": "Uso: python3 review_answer_sheet.py <imagen_o_pdf>"}))
+        return
+
+    if args.layout:
+        try:
+            args.layout = cargar_layout(args.layout)
+        except (OSError, ValueError) as e:
+            print(json.dumps({"error": f"Layout inválido: {e}"}))
+            return
+
+    cache = None if args.no_cache else abrir_cache()
+
+    almacen = None
+    if args.store:
+        ruta_almacen = args.store if os.path.dirname(args.store) else os.path.join(DETECTED_EXAMS_DIR, args.store)
+        almacen = AlmacenResultados(ruta_almacen)
+    try:
+        revisar_cli(args, cache, almacen)
+    finally:
+        if almacen is not None:
+            almacen.cerrar()
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
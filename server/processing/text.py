@@ -5,23 +5,85 @@ import os
 import sys
 import json
 import time
+import argparse
+import multiprocessing
 
-def main():
-    if len(sys.argv) != 2:
-        error_response("Uso: python text.py <imagen>")
-    
-    image_path = sys.argv[1]
+from cache_resultados import CacheResultados, CACHE_DIR, clave_pagina
 
-    image = cv2.imread(image_path)
-    if image is None:
-        error_response("Error: No se pudo abrir la imagen.")
+# Modo --fields: OCR solo de los campos del encabezado en vez de toda la página
+FRACCION_ENCABEZADO = 0.4  # Parte superior de la página donde se buscan las líneas de los campos
+LINEA_ANCHO_MIN = 0.15     # Ancho mínimo de una línea de campo (fracción del ancho de la página)
+LINEA_ALTO_MAX = 0.01      # Alto máximo de una línea de campo (fracción del alto de la página)
+RENGLON_ALTO = 0.03        # Alto del renglón de texto sobre cada línea (fracción del alto de la página)
+MAX_CAMPOS = 4
+CONFIG_PAGINA = r'--oem 3 --psm 6'
+CONFIG_CAMPO = r'--oem 3 --psm 7'  # Una sola línea de texto
+# Lote (varias imágenes o carpetas): caché de OCR por contenido, aparte de la de revisiones
+VERSION_OCR = 1  # Cambiarla si cambia lo que produce procesar_imagen
+OCR_CACHE_PATH = os.environ.get("OCR_CACHE_PATH", os.path.join(CACHE_DIR, "ocr.sqlite"))
+EXTENSIONES_IMAGEN = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+def localizar_campos(gray):
+    """
+    Renglones de los campos del encabezado (p. ej. la línea de "Nombre del
+    Alumno:" que dibuja generate_answer_sheet.py): busca líneas horizontales
+    largas en la parte superior y devuelve, de arriba hacia abajo, el
+    rectángulo (x, y, w, h) del texto sobre cada una, desde el margen
+    izquierdo (donde va la etiqueta) hasta el final de la línea.
+    """
+    alto, ancho = gray.shape
+    superior = gray[:int(alto * FRACCION_ENCABEZADO)]
+    _, binaria = cv2.threshold(superior, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(1, int(ancho * LINEA_ANCHO_MIN)), 1))
+    lineas = cv2.morphologyEx(binaria, cv2.MORPH_OPEN, kernel)
+    contornos, _ = cv2.findContours(lineas, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    renglon = max(1, int(alto * RENGLON_ALTO))
+    # Trazos verticales: los bordes de los recuadros (matrícula, grupo, preguntas)
+    # también son líneas largas, pero con un trazo vertical en cada extremo
+    verticales = cv2.morphologyEx(binaria, cv2.MORPH_OPEN,
+                                  cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(1, renglon // 2))))
+
+    def extremo_con_vertical(x, y, h):
+        return cv2.countNonZero(verticales[max(0, y - renglon):y + h + renglon, max(0, x - 3):x + 4]) > 0
+
+    campos = []
+    for x, y, w, h in sorted((cv2.boundingRect(c) for c in contornos), key=lambda r: r[1]):
+        if h > alto * LINEA_ALTO_MAX or y < renglon:
+            continue
+        if extremo_con_vertical(x, y, h) and extremo_con_vertical(x + w - 1, y, h):
+            continue
+        x2 = min(ancho, x + w + renglon)
+        # Sin las últimas filas: el antialias de la línea se leería como texto
+        campos.append((0, y - renglon, x2, max(1, renglon - 2)))
+    return campos[:MAX_CAMPOS]
+
+def ocr_pagina(gray):
+    """OCR de la página completa binarizada (modo por defecto)."""
     _, thresholded = cv2.threshold(gray, 128, 255, cv2.THRESH_BINARY)
+    return pytesseract.image_to_string(thresholded, config=CONFIG_PAGINA).strip()
 
-    custom_config = r'--oem 3 --psm 6'
-    texto_detectado = pytesseract.image_to_string(thresholded, config=custom_config).strip()
+def ocr_campos(gray):
+    """
+    OCR de un renglón por campo del encabezado con --psm 7. Devuelve el texto
+    de los renglones unido por saltos de línea, o None si no hay campos.
+    """
+    campos = localizar_campos(gray)
+    if not campos:
+        return None
+    renglones = []
+    for x, y, w, h in campos:
+        recorte = gray[y:y + h, x:x + w]
+        _, recorte = cv2.threshold(recorte, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        # Borde blanco: Tesseract lee peor el texto pegado al borde
+        recorte = cv2.copyMakeBorder(recorte, 10, 10, 10, 10, cv2.BORDER_CONSTANT, value=255)
+        texto = pytesseract.image_to_string(recorte, config=CONFIG_CAMPO).strip()
+        if texto:
+            renglones.append(texto)
+    return "\n".join(renglones)
 
+def extraer_datos(texto_detectado, image_path, solo_campos=False):
+    """Preguntas, matrícula y nombre a partir del texto detectado (JSON de salida)."""
     # Expresiones regulares para preguntas
     pattern_tf = re.compile(r'(\d+)\.\s*(true|false)', re.IGNORECASE)
     pattern_fill = re.compile(r'(\d+)\.\s*([_\w]+)\s*[:：]', re.IGNORECASE)
@@ -50,15 +112,19 @@ def main():
                 "answer": cleaned_answer
             })
 
-    # Extraer matrícula y nombre
-    matricula_match = re.search(r'Matricula:\s*(\d+)', texto_detectado, re.IGNORECASE)
-    nombre_match = re.search(r'Nombre completo:\s*(.+?)(?:\n|$)', texto_detectado, re.IGNORECASE)
+    # Extraer matrícula y nombre (en los renglones de campos también la etiqueta
+    # de la hoja generada: "Nombre del Alumno:", "Matrícula:")
+    if solo_campos:
+        matricula_match = re.search(r'Matr[ií]cula:\s*(\d+)', texto_detectado, re.IGNORECASE)
+        nombre_match = re.search(r'Nombre (?:completo|del Alumno):\s*(.+?)(?:\n|$)', texto_detectado, re.IGNORECASE)
+    else:
+        matricula_match = re.search(r'Matricula:\s*(\d+)', texto_detectado, re.IGNORECASE)
+        nombre_match = re.search(r'Nombre completo:\s*(.+?)(?:\n|$)', texto_detectado, re.IGNORECASE)
 
     matricula = matricula_match.group(1) if matricula_match else None
     nombre_completo = nombre_match.group(1).strip() if nombre_match else None
 
-    # JSON final
-    output = {
+    return {
         "texto_detectado": texto_detectado,
         "nombre_imagen": image_path,
         "matricula": matricula,
@@ -66,8 +132,31 @@ def main():
         "preguntas_detectadas": sorted(questions_with_answers, key=lambda x: x["question_number"])
     }
 
-    # Guardar archivo local (opcional)
-    output_dir = "./detected_exams"
+def procesar_imagen(image_path, solo_campos=False):
+    """
+    OCR de una imagen. Con solo_campos se leen únicamente los renglones del
+    encabezado; si no se encuentra ninguno se cae a la página completa.
+    Devuelve el JSON de salida más "modo_ocr" ("campos" o "pagina") y el
+    tiempo de la página en "tiempo_ms", que solo usan --fields y el lote.
+    """
+    inicio = time.perf_counter()
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError("Error: No se pudo abrir la imagen.")
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    texto_detectado = ocr_campos(gray) if solo_campos else None
+    modo = "campos"
+    if texto_detectado is None:
+        texto_detectado = ocr_pagina(gray)
+        modo = "pagina"
+
+    output = extraer_datos(texto_detectado, image_path, modo == "campos")
+    output["modo_ocr"] = modo
+    output["tiempo_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+    return output
+
+def guardar_resultado(output, image_path, output_dir="./detected_exams"):
     os.makedirs(output_dir, exist_ok=True)
 
     timestamp = int(time.time() * 1000)
@@ -77,10 +166,152 @@ def main():
 
     with open(json_path, "w", encoding="utf-8") as f:
         json.dump(output, f, indent=4, ensure_ascii=False)
+    return json_path
+
+def _orden_natural(nombre):
+    """page_2.png antes que page_10.png"""
+    return [int(t) if t.isdigit() else t.lower() for t in re.split(r'(\d+)', nombre)]
+
+def expandir_imagenes(entradas):
+    """Imágenes de las entradas: una carpeta aporta las suyas en orden natural (page_1, page_2, ..., page_10)."""
+    rutas = []
+    for entrada in entradas:
+        if os.path.isdir(entrada):
+            rutas.extend(os.path.join(entrada, f) for f in sorted(os.listdir(entrada), key=_orden_natural)
+                         if os.path.splitext(f)[1].lower() in EXTENSIONES_IMAGEN)
+        else:
+            rutas.append(entrada)
+    return rutas
+
+def _inicializar_worker():
+    # El pool ya reparte las imágenes entre núcleos: Tesseract (OpenMP) y OpenCV con un hilo
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    cv2.setNumThreads(1)
+
+def _ocr_tarea(tarea):
+    image_path, solo_campos = tarea
+    try:
+        return procesar_imagen(image_path, solo_campos)
+    except Exception as e:
+        return {"error": str(e), "nombre_imagen": image_path}
+
+def procesar_lote(rutas, solo_campos=False, num_workers=None, cache=None):
+    """
+    OCR de varias imágenes en un pool de procesos. Con cache, las imágenes
+    cuyo contenido ya se leyó con la misma configuración (y versión de
+    Tesseract) no se vuelven a leer. Devuelve el JSON consolidado del lote.
+    """
+    inicio = time.perf_counter()
+    resultados = [None] * len(rutas)
+    claves = {}
+    if cache is not None:
+        configuracion = {"ocr": VERSION_OCR, "campos": bool(solo_campos),
+                         "tesseract": str(pytesseract.get_tesseract_version())}
+        for i, ruta in enumerate(rutas):
+            try:
+                claves[i] = clave_pagina(cache.hash_documento(ruta), None, configuracion)
+            except OSError:
+                pass  # procesar_imagen reporta el error
+        guardados = cache.obtener_varios(set(claves.values()))
+        for i, clave in claves.items():
+            if clave in guardados:
+                resultados[i] = dict(guardados[clave], nombre_imagen=rutas[i], cache=True)
+
+    pendientes = [i for i, r in enumerate(resultados) if r is None]
+    num_workers = min(num_workers or os.cpu_count() or 1, len(pendientes))
+    tareas = [(rutas[i], solo_campos) for i in pendientes]
+    if num_workers > 1:
+        with multiprocessing.Pool(num_workers, initializer=_inicializar_worker) as pool:
+            leidos = pool.imap(_ocr_tarea, tareas)
+            for i, output in zip(pendientes, leidos):
+                resultados[i] = output
+    else:
+        for i, tarea in zip(pendientes, tareas):
+            resultados[i] = _ocr_tarea(tarea)
+
+    if cache is not None:
+        for i in pendientes:
+            if "error" not in resultados[i] and i in claves:
+                cache.guardar(claves[i], resultados[i])
+
+    return {
+        "total_images": len(rutas),
+        "processed": len(pendientes),
+        "cached": len(rutas) - len(pendientes),
+        "errors": sum(1 for r in resultados if "error" in r),
+        "tiempo_ms": round((time.perf_counter() - inicio) * 1000, 1),
+        "results": resultados,
+    }
+
+def abrir_cache_ocr():
+    """Caché del lote; si no se puede abrir se procesa sin ella."""
+    try:
+        return CacheResultados(OCR_CACHE_PATH)
+    except Exception as e:
+        sys.stderr.write(f"[WARN] Caché de OCR desactivada: {e}\n")
+        return None
+
+class _ParserJSON(argparse.ArgumentParser):
+    """Los errores de invocación salen como antes: JSON de error_response en stdout y código 1."""
+
+    def error(self, message):
+        error_response(f"Uso: python text.py <imagen> [--fields] | <carpeta|imágenes...> [--workers N] "
+                       f"[--output archivo] [--no-cache] ({message})")
+
+def main():
+    parser = _ParserJSON(
+        description="OCR de hojas de examen. Con una imagen escribe su JSON en ./detected_exams; con una "
+                    "carpeta (p. ej. output_images/<id> de process_pdf.py) o varias imágenes corre en lote "
+                    "y escribe un solo JSON consolidado")
+    parser.add_argument("entradas", nargs="+", help="Imagen de la página, o carpetas/imágenes para el lote")
+    parser.add_argument("--fields", action="store_true",
+                        help="OCR solo de los renglones de los campos del encabezado (nombre, matrícula) "
+                             "en lugar de la página completa")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Procesos del lote (default: núcleos de la CPU)")
+    parser.add_argument("--output", default=None, help="Archivo del JSON consolidado del lote (default: stdout)")
+    parser.add_argument("--no-cache", action="store_true", help="Lote sin caché de OCR por contenido")
+    args = parser.parse_args()
+
+    if len(args.entradas) > 1 or os.path.isdir(args.entradas[0]):
+        procesar_lote_cli(args)
+        return
+
+    image_path = args.entradas[0]
+    try:
+        output = procesar_imagen(image_path, args.fields)
+    except ValueError as e:
+        error_response(str(e))
+    if not args.fields:
+        # Sin --fields la salida de una imagen conserva su forma de siempre
+        del output["modo_ocr"], output["tiempo_ms"]
+
+    # Guardar archivo local (opcional)
+    guardar_resultado(output, image_path)
 
     #  Imprimir solo el JSON en consola (stdout limpio)
     print(json.dumps(output, ensure_ascii=False))
 
+def procesar_lote_cli(args):
+    rutas = expandir_imagenes(args.entradas)
+    cache = None if args.no_cache else abrir_cache_ocr()
+    try:
+        lote = procesar_lote(rutas, args.fields, args.workers, cache)
+    except pytesseract.TesseractNotFoundError as e:
+        error_response(str(e))
+    finally:
+        if cache is not None:
+            cache.cerrar()
+
+    texto = json.dumps(lote, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+        resumen = {k: v for k, v in lote.items() if k != "results"}
+        print(json.dumps(dict(resumen, output=args.output)))
+    else:
+        print(texto)
+
 def error_response(message):
     error = {
         "error": True,
@@ -9,6 +9,15 @@ Este script:
 3. Preprocesa la imagen para el modelo
 4. Predice el número usando el modelo CNN entrenado
 5. Muestra resultados con visualización
+
+Modo headless (--headless o process_answer_sheet(headless=True)): sin
+matplotlib, sin texto de progreso en stdout y con el resultado como JSON.
+TensorFlow y matplotlib se importan solo cuando se necesitan (la primera
+predicción y la primera visualización), así que importar el módulo es rápido
+y sirve dentro de un worker de servidor.
+
+Con un modelo exportado a .npz (numpy_cnn.py export) la predicción corre solo
+con NumPy y TensorFlow no hace falta instalarlo.
 """
  
 import os
@@ -17,79 +26,64 @@ os.environ["TF_ENABLE_ONEDNN_OPTS"] = "0"
 
 import sys
 import io
-
-# Forzar stdout y stderr a UTF-8 para evitar errores de encoding en Windows
-if sys.stdout.encoding is None or sys.stdout.encoding.lower() != 'utf-8':
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-if sys.stderr.encoding is None or sys.stderr.encoding.lower() != 'utf-8':
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+import importlib.util
 
 import cv2
 import numpy as np
 import json
-import matplotlib.pyplot as plt
-from PIL import Image
 import argparse
-import re
+
+from geometria import agrupar_por_media
  
-# Verificar TensorFlow
-try:
-    import tensorflow as tf
+# Se revisa que TensorFlow esté instalado sin importarlo (importarlo tarda segundos)
+TF_AVAILABLE = importlib.util.find_spec("tensorflow") is not None
+
+def _force_utf8_stdio():
+    """Forzar stdout y stderr a UTF-8 para evitar errores de encoding en Windows"""
+    if sys.stdout.encoding is None or sys.stdout.encoding.lower() != 'utf-8':
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    if sys.stderr.encoding is None or sys.stderr.encoding.lower() != 'utf-8':
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+def _no_log(*args, **kwargs):
+    pass
+
+def _pyplot():
+    """Importa matplotlib solo cuando se pide una visualización"""
+    import matplotlib.pyplot as plt
+    return plt
+
+def _keras():
+    """Importa Keras (TensorFlow) solo cuando hace falta cargar un modelo"""
     from tensorflow import keras
-    TF_AVAILABLE = True
-    # Solo imprimir si se ejecuta como script principal
-    if __name__ == "__main__":
-        print(f"TensorFlow {tf.__version__} disponible")
-except ImportError:
-    TF_AVAILABLE = False
-    if __name__ == "__main__":
-        print("TensorFlow no disponible")
+    return keras
  
-def sort_squares_reading_order(squares, tolerance_y=30):
+def sort_squares_reading_order(squares, tolerance_y=30, verbose=True):
     """
     Ordena los cuadrados en orden de lectura (izquierda a derecha, arriba hacia abajo)
     """
+    log = print if verbose else _no_log
     if not squares:
         return []
    
-    print("Ordenando recuadros en orden de lectura...")
+    log("Ordenando recuadros en orden de lectura...")
    
-    # Agrupar por líneas horizontales
-    lines = []
-   
-    for square in squares:
-        center_x, center_y = square['center']
-        added_to_line = False
-       
-        # Buscar línea existente
-        for line in lines:
-            avg_y = sum(s['center'][1] for s in line) / len(line)
-            if abs(center_y - avg_y) < tolerance_y:
-                line.append(square)
-                added_to_line = True
-                break
-       
-        # Si no encontró línea, crear nueva
-        if not added_to_line:
-            lines.append([square])
-   
-    # Ordenar líneas por Y (de arriba hacia abajo)
-    lines.sort(key=lambda line: sum(s['center'][1] for s in line) / len(line))
-   
-    # Dentro de cada línea, ordenar por X (de izquierda a derecha)
-    for line in lines:
-        line.sort(key=lambda square: square['center'][0])
+    # Agrupar por líneas horizontales (cada cuadro a la línea cuya Y media
+    # está dentro de la tolerancia), de arriba hacia abajo y, dentro de cada
+    # línea, de izquierda a derecha
+    lines = [[squares[i] for i in line]
+             for line in agrupar_por_media([s['center'] for s in squares], tolerance_y)]
    
     # Combinar todas las líneas en orden de lectura
     reading_order_squares = []
     for i, line in enumerate(lines):
         avg_y = sum(s['center'][1] for s in line) / len(line)
-        print(f"  Línea {i+1}: Y≈{avg_y:.0f}, {len(line)} cuadrados")
+        log(f"  Línea {i+1}: Y≈{avg_y:.0f}, {len(line)} cuadrados")
         reading_order_squares.extend(line)
    
     return reading_order_squares
  
-def detect_largest_squares(image, min_area=1000, top_fraction=0.25):
+def detect_largest_squares(image, min_area=1000, top_fraction=0.25, verbose=True):
     """
     Detecta los cuadros más grandes en la parte superior de la imagen
    
@@ -102,17 +96,18 @@ def detect_largest_squares(image, min_area=1000, top_fraction=0.25):
         list: Lista de cuadrados detectados
         numpy.ndarray: Región analizada de la imagen
     """
-    print("DETECTANDO CUADROS MÁS GRANDES")
-    print("=" * 50)
+    log = print if verbose else _no_log
+    log("DETECTANDO CUADROS MÁS GRANDES")
+    log("=" * 50)
    
     height, width = image.shape[:2]
-    print(f"Dimensiones de imagen: {width}x{height}")
+    log(f"Dimensiones de imagen: {width}x{height}")
    
     # Extraer la parte superior de la imagen
     top_height = int(height * top_fraction)
     top_region = image[0:top_height, :]
    
-    print(f"Analizando región superior: {width}x{top_height}")
+    log(f"Analizando región superior: {width}x{top_height}")
    
     # Convertir a escala de grises
     gray = cv2.cvtColor(top_region, cv2.COLOR_BGR2GRAY)
@@ -125,7 +120,7 @@ def detect_largest_squares(image, min_area=1000, top_fraction=0.25):
    
     large_squares = []
    
-    print(f"Analizando {len(contours)} contornos...")
+    log(f"Analizando {len(contours)} contornos...")
    
     for contour in contours:
         # Aproximar el contorno a un polígono
@@ -160,7 +155,7 @@ def detect_largest_squares(image, min_area=1000, top_fraction=0.25):
     # Ordenar por área (más grande primero)
     large_squares.sort(key=lambda x: x['area'], reverse=True)
    
-    print(f"\\nENCONTRADOS {len(large_squares)} CUADROS GRANDES")
+    log(f"\\nENCONTRADOS {len(large_squares)} CUADROS GRANDES")
    
     return large_squares, top_region
  
@@ -201,25 +196,98 @@ def preprocess_square_for_model(roi, target_size=(64, 64)):
     model_input = np.expand_dims(np.expand_dims(normalized, axis=0), axis=-1)
     return model_input, processed
  
-def load_trained_model(model_path=None):
+def preprocess_squares_batch(image, squares, margin=5, limit=25, target_size=(64, 64), verbose=True):
+    """
+    Recorta y preprocesa todos los cuadros en un solo tensor para predecir de una vez
+   
+    Args:
+        image: Imagen de donde se recortan los cuadros
+        squares: Lista de cuadros detectados (en orden de lectura)
+        margin: Margen en píxeles alrededor de cada cuadro
+        limit: Número máximo de cuadros a procesar
+        target_size: Tamaño de entrada del modelo (ancho, alto)
+   
+    Returns:
+        numpy.ndarray: Tensor float32 (N, alto, ancho, 1) normalizado a [0, 1]
+        list: Imágenes preprocesadas (uint8) para visualización
+        list: Pares (índice, cuadro) de los cuadros incluidos en el tensor
+    """
+    log = print if verbose else _no_log
+    processed_rois = []
+    kept = []
+    for i, square in enumerate(squares[:limit]):
+        x, y, w, h = square['bbox']
+        x1 = max(0, x - margin)
+        y1 = max(0, y - margin)
+        x2 = min(image.shape[1], x + w + margin)
+        y2 = min(image.shape[0], y + h + margin)
+        roi = image[y1:y2, x1:x2]
+        if roi.size == 0:
+            log("   ROI vacío")
+            continue
+        processed_rois.append(preprocess_square_image(roi, target_size))
+        kept.append((i, square))
+
+    target_w, target_h = target_size
+    if not processed_rois:
+        return np.zeros((0, target_h, target_w, 1), dtype=np.float32), [], []
+    batch = np.stack(processed_rois).astype(np.float32)[..., np.newaxis] / 255.0
+    return batch, processed_rois, kept
+
+def default_model_path():
     """
-    Carga el modelo CNN entrenado
+    Modelo por defecto: ai_models/number_recognition_model.npz (inferencia solo
+    con NumPy) si ya se exportó, si no el .h5 de Keras
+    """
+    base = os.path.join(os.path.dirname(__file__), "ai_models", "number_recognition_model")
+    return base + ".npz" if os.path.exists(base + ".npz") else base + ".h5"
+
+def load_trained_model(model_path=None, verbose=True):
     """
+    Carga el modelo CNN entrenado: .npz exportado (NumPy) o .h5/.keras (TensorFlow)
+    """
+    log = print if verbose else _no_log
     if model_path is None:
-        model_path = os.path.join(os.path.dirname(__file__), "ai_models", "number_recognition_model.h5")
+        model_path = default_model_path()
     if not os.path.exists(model_path):
-        print(f"No se encontró el modelo: {model_path}")
-        print("Asegúrate de haber entrenado el modelo primero")
+        log(f"No se encontró el modelo: {model_path}")
+        log("Asegúrate de haber entrenado el modelo primero")
         return None
     try:
-        model = keras.models.load_model(model_path)
-        print(f"Modelo cargado desde: {model_path}")
+        if model_path.endswith(".npz"):
+            # Modelo exportado con numpy_cnn.py: no necesita TensorFlow
+            from numpy_cnn import NumpyCNN
+            model = NumpyCNN(model_path)
+        elif not TF_AVAILABLE:
+            log("TensorFlow no está disponible (exporta el modelo a .npz con numpy_cnn.py)")
+            return None
+        else:
+            model = _keras().models.load_model(model_path)
+        log(f"Modelo cargado desde: {model_path}")
         return model
     except Exception as e:
-        print(f"Error cargando el modelo: {e}")
+        log(f"Error cargando el modelo: {e}")
         return None
+
+# Modelos ya cargados en este proceso, por ruta absoluta
+_model_cache = {}
+
+def get_model(model_path=None, verbose=True):
+    """
+    Devuelve el modelo CNN cargándolo del disco solo la primera vez por proceso,
+    para que un mismo worker procese muchas hojas con una sola carga
+    """
+    if model_path is None:
+        model_path = default_model_path()
+    key = os.path.abspath(model_path)
+    if key not in _model_cache:
+        model = load_trained_model(model_path, verbose)
+        if model is None:
+            return None
+        _model_cache[key] = model
+    return _model_cache[key]
  
-def predict_numbers_in_squares(image, squares, model, visualize=True):
+def predict_numbers_in_squares(image, squares, model, visualize=True, verbose=True):
     """
     Predice números en cada cuadro usando el modelo entrenado
    
@@ -228,55 +296,49 @@ def predict_numbers_in_squares(image, squares, model, visualize=True):
         squares: Lista de cuadros detectados
         model: Modelo CNN entrenado
         visualize: Si mostrar visualización
+        verbose: Si imprimir el progreso en stdout
    
     Returns:
         list: Lista de predicciones
     """
-    print("\nPREDICIENDO NÚMEROS CON EL MODELO...")
-    print("=" * 50)
+    log = print if verbose else _no_log
+    log("\nPREDICIENDO NÚMEROS CON EL MODELO...")
+    log("=" * 50)
 
     predictions = []
 
     # Crear visualización si se solicita
     if visualize:
+        plt = _pyplot()
         fig, axes = plt.subplots(2, 5, figsize=(15, 8))
         axes = axes.flatten()
 
-    for i, square in enumerate(squares[:25]):  # Limitar a 25 cuadros para visualización
-        # Usar la imagen original para extraer el ROI
-        x, y, w, h = square['bbox']
-        center = square['center']
-        margin = 5
-        x1 = max(0, x - margin)
-        y1 = max(0, y - margin)
-        x2 = min(image.shape[1], x + w + margin)
-        y2 = min(image.shape[0], y + h + margin)
-        roi = image[y1:y2, x1:x2]
-        if roi.size == 0:
-            print("   ROI vacío")
-            continue
-        # Preprocesar para el modelo usando el pipeline robusto
-        model_input, processed_roi = preprocess_square_for_model(roi)
+    # Todos los cuadros (máx. 25) en un solo tensor (N, 64, 64, 1) y una sola inferencia
+    batch, processed_rois, kept = preprocess_squares_batch(image, squares, verbose=verbose)
+    probabilities = None
+    if kept:
         try:
-            prediction = model.predict(model_input, verbose=0)
-            predicted_digit = np.argmax(prediction)
+            probabilities = np.asarray(model.predict_on_batch(batch))
+        except Exception as e:
+            log(f"   Error en predicción: {e}")
+
+    if probabilities is not None:
+        for (i, square), processed_roi, prediction in zip(kept, processed_rois, probabilities):
+            predicted_digit = int(np.argmax(prediction))
             confidence = float(np.max(prediction))
-            print(f"   Predicción: {predicted_digit} (confianza: {confidence:.3f})")
-            result = {
+            log(f"   Predicción: {predicted_digit} (confianza: {confidence:.3f})")
+            predictions.append({
                 'index': i + 1,
-                'center': center,
-                'bbox': (x, y, w, h),
-                'predicted_digit': int(predicted_digit),
+                'center': square['center'],
+                'bbox': square['bbox'],
+                'predicted_digit': predicted_digit,
                 'confidence': confidence,
-                'all_probabilities': prediction[0].tolist()
-            }
-            predictions.append(result)
+                'all_probabilities': prediction.tolist()
+            })
             if visualize and i < len(axes):
                 axes[i].imshow(processed_roi, cmap='gray')
                 axes[i].set_title(f'Cuadro {i+1}: {predicted_digit}\n(conf: {confidence:.2f})')
                 axes[i].axis('off')
-        except Exception as e:
-            print(f"   Error en predicción: {e}")
     if visualize:
         for idx in range(len(squares), len(axes)):
             axes[idx].axis('off')
@@ -323,6 +385,7 @@ def visualize_detections_and_predictions(image, squares, predictions):
                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
    
     # Mostrar visualización
+    plt = _pyplot()
     plt.figure(figsize=(15, 10))
     plt.imshow(cv2.cvtColor(visualization, cv2.COLOR_BGR2RGB))
     plt.title(f"Cuadros Detectados y Predicciones ({len(predictions)} cuadros)")
@@ -331,7 +394,7 @@ def visualize_detections_and_predictions(image, squares, predictions):
     
  
 def process_answer_sheet(image_path, model_path=None,
-                        min_area=1000, top_fraction=0.25, save_results=True):
+                        min_area=1000, top_fraction=0.25, save_results=True, headless=False):
     """
     Función principal para procesar una hoja de respuestas
    
@@ -341,51 +404,56 @@ def process_answer_sheet(image_path, model_path=None,
         min_area: Área mínima de cuadros
         top_fraction: Fracción superior a analizar
         save_results: Si guardar resultados en JSON
+        headless: Modo servidor: sin visualización ni texto de progreso; los
+            errores se devuelven como {"error": ...} en lugar de None
    
     Returns:
         dict: Resultados del procesamiento
     """
-    print("PROCESANDO HOJA DE RESPUESTAS...")
-    print("=" * 60)
-   
-    # Verificar TensorFlow
-    if not TF_AVAILABLE:
-        print("TensorFlow no está disponible")
+    log = _no_log if headless else print
+    verbose = not headless
+
+    def fail(message):
+        if headless:
+            return {'error': message, 'image_path': image_path}
+        log(message)
         return None
+
+    log("PROCESANDO HOJA DE RESPUESTAS...")
+    log("=" * 60)
    
     # Cargar imagen
     if not os.path.exists(image_path):
-        print(f"No se encontró la imagen: {image_path}")
-        return None
+        return fail(f"No se encontró la imagen: {image_path}")
    
     image = cv2.imread(image_path)
     if image is None:
-        print(f"No se pudo cargar la imagen: {image_path}")
-        return None
+        return fail(f"No se pudo cargar la imagen: {image_path}")
    
     height, width = image.shape[:2]
-    print(f"Imagen cargada: {width}x{height} píxeles")
+    log(f"Imagen cargada: {width}x{height} píxeles")
    
-    # Cargar modelo
-    model = load_trained_model(model_path)
-    if model is None:
-        return None
-   
-    # Detectar cuadros
-    large_squares, top_region = detect_largest_squares(image, min_area, top_fraction)
+    # Detectar cuadros (antes de cargar el modelo: sin cuadros no hace falta TensorFlow)
+    large_squares, top_region = detect_largest_squares(image, min_area, top_fraction, verbose)
    
     if not large_squares:
-        print("No se detectaron cuadros")
-        return None
+        return fail("No se detectaron cuadros")
+   
+    # Cargar modelo (una sola vez por proceso)
+    model = get_model(model_path, verbose)
+    if model is None:
+        return fail(f"No se pudo cargar el modelo: {model_path or default_model_path()}")
    
     # Ordenar en orden de lectura
-    reading_order_squares = sort_squares_reading_order(large_squares)
+    reading_order_squares = sort_squares_reading_order(large_squares, verbose=verbose)
    
     # Predecir números
-    predictions = predict_numbers_in_squares(top_region, reading_order_squares, model)
+    predictions = predict_numbers_in_squares(top_region, reading_order_squares, model,
+                                             visualize=not headless, verbose=verbose)
    
     # Visualizar resultados
-    visualize_detections_and_predictions(top_region, reading_order_squares, predictions)
+    if not headless:
+        visualize_detections_and_predictions(top_region, reading_order_squares, predictions)
 
     # Preparar resultados (con extracción de nombre, matrícula y grupo desde la secuencia predicha)
     pred_sequence = [str(p['predicted_digit']) for p in predictions]
@@ -411,32 +479,32 @@ def process_answer_sheet(image_path, model_path=None,
     }
    
     # Mostrar resumen
-    print("\\nRESUMEN DE RESULTADOS:")
-    print("=" * 40)
-    print(f"Imagen: {os.path.basename(image_path)}")
-    print(f"Cuadros detectados: {len(large_squares)}")
-    print(f"Predicciones realizadas: {len(predictions)}")
+    log("\\nRESUMEN DE RESULTADOS:")
+    log("=" * 40)
+    log(f"Imagen: {os.path.basename(image_path)}")
+    log(f"Cuadros detectados: {len(large_squares)}")
+    log(f"Predicciones realizadas: {len(predictions)}")
    
     if predictions:
         sequence = ''.join(str(p['predicted_digit']) for p in predictions)
         avg_confidence = sum(p['confidence'] for p in predictions) / len(predictions)
-        print(f"Secuencia predicha: {sequence}")
-        print(f"Confianza promedio: {avg_confidence:.3f}")
+        log(f"Secuencia predicha: {sequence}")
+        log(f"Confianza promedio: {avg_confidence:.3f}")
        
         # Mostrar predicciones individuales
-        print("\\nPREDICCIONES DETALLADAS:")
+        log("\\nPREDICCIONES DETALLADAS:")
         for pred in predictions:
-            print(f"   Cuadro {pred['index']:2d}: {pred['predicted_digit']} "
-                  f"(confianza: {pred['confidence']:.3f})")
+            log(f"   Cuadro {pred['index']:2d}: {pred['predicted_digit']} "
+                f"(confianza: {pred['confidence']:.3f})")
    
     # Guardar resultados si se solicita
     if save_results:
         output_file = f"predictions_{os.path.splitext(os.path.basename(image_path))[0]}.json"
         with open(output_file, 'w', encoding='utf-8') as f:
             json.dump(results, f, indent=2, ensure_ascii=False)
-        print(f"\\nResultados guardados en: {output_file}")
+        log(f"\\nResultados guardados en: {output_file}")
    
-    print("\\nPROCESAMIENTO COMPLETADO")
+    log("\\nPROCESAMIENTO COMPLETADO")
    
     return results
  
@@ -445,15 +513,18 @@ def main():
     parser = argparse.ArgumentParser(description='Detectar y predecir números en hojas de respuesta')
     parser.add_argument('image_path', help='Ruta de la imagen a procesar')
     parser.add_argument('--model', default=None,
-                       help='Ruta del modelo entrenado (default: ./ai_models/number_recognition_model.h5)')
+                       help='Ruta del modelo entrenado, .npz o .h5 (default: ./ai_models/number_recognition_model.npz si existe, si no .h5)')
     parser.add_argument('--min-area', type=int, default=1000,
                        help='Área mínima de cuadros (default: 1000)')
     parser.add_argument('--top-fraction', type=float, default=0.25,
                        help='Fracción superior a analizar (default: 0.25)')
     parser.add_argument('--no-save', action='store_true',
                        help='No guardar resultados en JSON')
+    parser.add_argument('--headless', action='store_true',
+                       help='Modo servidor: sin ventanas ni progreso; imprime solo el resultado JSON en stdout')
    
     args = parser.parse_args()
+    _force_utf8_stdio()
    
     # Procesar imagen
     results = process_answer_sheet(
@@ -461,8 +532,14 @@ def main():
         model_path=args.model,
         min_area=args.min_area,
         top_fraction=args.top_fraction,
-        save_results=not args.no_save
+        save_results=not args.no_save,
+        headless=args.headless
     )
+
+    if args.headless:
+        sys.stdout.write(json.dumps(results, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+        return
    
     if results:
         print("\\nProcesamiento exitoso!")
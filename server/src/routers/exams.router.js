@@ -248,11 +248,48 @@ router.post("/grade-exams", authenticateToken, async (req, res) => {
         .json({ error: "No se encontró la carpeta de exámenes detectados." });
     }
 
-    const files = fs
-      .readdirSync(detectedExamsFolder)
-      .filter((file) => file.endsWith(".json"));
+    const folderFiles = fs.readdirSync(detectedExamsFolder);
+    const files = folderFiles.filter((file) => file.endsWith(".json"));
+    // Almacenes de lote (review_answer_sheet.py --store): un resultado por línea
+    const batchFiles = folderFiles.filter((file) => file.endsWith(".jsonl"));
+
+    // Nombre de un resultado del almacén: el mismo del reviewed_*.json que
+    // review_answer_sheet.py escribe para esa página o imagen
+    const reviewedName = (data) => {
+      if (data.page) {
+        return `reviewed_${path.basename(data.pdfFile, path.extname(data.pdfFile))}_page_${data.page}.json`;
+      }
+      const imagePath = data.imagen_procesada || "";
+      const base = path.basename(imagePath).replaceAll(".png", "").replaceAll(".jpg", "").replaceAll(".jpeg", "");
+      return `reviewed_${path.basename(path.dirname(imagePath))}_${base}.json`;
+    };
+
+    // Cada entrada es un resultado de página: { file, data }. Una página que
+    // está en un almacén y además en su reviewed_*.json se califica una sola
+    // vez, con el resultado del almacén
+    const entriesByName = new Map();
+    for (const file of files) {
+      entriesByName.set(file, {
+        file,
+        data: JSON.parse(fs.readFileSync(path.join(detectedExamsFolder, file), "utf-8")),
+      });
+    }
+    for (const batchFile of batchFiles) {
+      // Todo el lote se carga con una sola lectura secuencial
+      const lines = fs.readFileSync(path.join(detectedExamsFolder, batchFile), "utf-8").split("\n");
+      // Lo que sigue al último "\n" está vacío o es una línea a medio escribir
+      lines.pop();
+      for (const line of lines) {
+        if (!line.trim()) continue;
+        const data = JSON.parse(line);
+        if (data.error || data.summary) continue;
+        const file = reviewedName(data);
+        entriesByName.set(file, { file, data });
+      }
+    }
+    const entries = [...entriesByName.values()];
 
-    if (files.length === 0) {
+    if (entries.length === 0) {
       return res
         .status(400)
         .json({ error: "No hay archivos JSON para procesar." });
@@ -301,10 +338,7 @@ router.post("/grade-exams", authenticateToken, async (req, res) => {
 
     const results = [];
 
-    for (const file of files) {
-      const filePath = path.join(detectedExamsFolder, file);
-      const data = JSON.parse(fs.readFileSync(filePath, "utf-8"));
-
+    for (const { file, data } of entries) {
       const detectedAnswers = data.preguntas_detectadas || [];
 
       let totalQuestions = detectedAnswers.length;